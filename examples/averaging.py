@@ -139,7 +139,10 @@ def average_argonne(n_particles,
             mix=True,
             balance=True, 
             plot=False, 
-            seed=0):
+            seed=0,
+            session=None,
+            keep_samples=False,
+            target=None):
 
     seeder = itertools.count(seed, 1)
 
@@ -181,27 +184,18 @@ def average_argonne(n_particles,
                 coulomb=coulomb, 
                 spinorbit=spinorbit,
                 parallel=parallel,
-                n_processes=n_processes)
-    b_plus = integ.run(bra, ket)
-    if balance:
-        integ.setup(n_samples=n_samples,
-                seed=seed, 
-                mix=mix,
-                flip_aux=True,
-                sigma=sigma, 
-                sigmatau=sigmatau, 
-                tau=tau, 
-                coulomb=coulomb, 
-                spinorbit=spinorbit,
-                parallel=parallel,
-                n_processes=n_processes)
-        b_minus = integ.run(bra, ket)
-        b_array = np.concatenate([b_plus, b_minus])
+                n_processes=n_processes,
+                session=session)
+    # the brackets are reduced in the workers; the raw samples are only kept when they are plotted or asked for
+    # with a target relative error, n_samples is only the budget
+    if target is None:
+        stats = integ.run(bra, ket, balance=balance, statistics=True, keep_samples=(plot or keep_samples))
     else:
-        b_array = b_plus
+        stats = integ.run_adaptive(bra, ket, target, balance=balance, keep_samples=(plot or keep_samples))
+    b_array = stats.samples
 
-    b_m = np.mean(b_array)
-    b_s = np.std(b_array)/np.sqrt(n_samples)
+    b_m = stats.mean
+    b_s = stats.error
     if full_basis:
         b_exact = integ.exact(bra, ket)
     else:
@@ -211,11 +205,14 @@ def average_argonne(n_particles,
     
     print("<bra|ket> = ", bra.inner(ket) )
     print(f'<bra|G|ket> = {b_m} +/- {b_s}')
+    print("effective sample size = ", stats.ess)
+    print("average phase = ", stats.phase)
     print('exact = ',b_exact)
     print("ratio = ", ratio )
     print("abs error = ", abs_error )
     print("dt^2 = ", dt**2)
-    print("1/sqrt(N) = ", 1/np.sqrt(n_samples) )
+    print("samples used = ", stats.n)
+    print("1/sqrt(N) = ", 1/np.sqrt(stats.n) )
 
     if plot:
         if full_basis:
@@ -229,6 +226,8 @@ def average_argonne(n_particles,
            "dt": dt,
            "full_basis": full_basis,
            "n_samples": n_samples,
+           "n_used": stats.n,
+           "target": target,
            "method": method,
            "balance": balance,
            "sigma": sigma,
@@ -240,6 +239,8 @@ def average_argonne(n_particles,
            "b_array": b_array,
            "b_m": b_m,
            "b_s": b_s,
+           "ess": stats.ess,
+           "phase": stats.phase,
            "b_exact": b_exact,
            "ratio": ratio,
            "abs_error": abs_error,
@@ -327,8 +328,9 @@ def experiment():
 
     args_list = list_from_dict(input_dict)
     out = []
-    for args in args_list:
-        out.append(average_argonne(**args))
+    with IntegratorSession(n_processes) as session:
+        for args in args_list:
+            out.append(average_argonne(**args, session=session))
         
     tag = int(time.time())
     with open(f"examples/outputs/experiment_{tag}.pkl","wb") as f:
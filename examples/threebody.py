@@ -44,8 +44,8 @@ def a2b_factors(k):
 
 def gfmc_3b_1d(n_particles, dt, a3, mode=1):
     # exp( - dt/2 sig_1x sig_2x sig_3x)
-    ident = HilbertOperator(n_particles, isospin=isospin)
-    sig = [[HilbertOperator(n_particles, isospin=isospin).apply_sigma(i,a) for a in [0, 1, 2]] for i in range(n_particles)]
+    ident = operator_bank.get(n_particles, ("ident",), isospin=isospin)
+    sig = [[operator_bank.sigma(n_particles, i, a, isospin=isospin) for a in [0, 1, 2]] for i in range(n_particles)]
     ket = ProductState(n_particles, isospin=isospin, ketwise=True).randomize(0)
     bra = ProductState(n_particles, isospin=isospin, ketwise=False).randomize(1)
     ket = ket.to_manybody_basis()
@@ -163,10 +163,10 @@ def afdmc_3b_1d(n_particles, dt, a3):
 
 def gfmc_3bprop(n_particles, dt, seed):
     seeder = itertools.count(seed, 1)
-    ident = HilbertOperator(n_particles, isospin=isospin)
-    sig = [[HilbertOperator(n_particles, isospin=isospin).apply_sigma(i,a) for a in [0, 1, 2]] for i in range(n_particles)]
+    ident = operator_bank.get(n_particles, ("ident",), isospin=isospin)
+    sig = [[operator_bank.sigma(n_particles, i, a, isospin=isospin) for a in [0, 1, 2]] for i in range(n_particles)]
     if isospin:
-        tau = [[HilbertOperator(n_particles, isospin=isospin).apply_tau(i,a) for a in [0, 1, 2]] for i in range(n_particles)]
+        tau = [[operator_bank.tau(n_particles, i, a, isospin=isospin) for a in [0, 1, 2]] for i in range(n_particles)]
     ket = ProductState(n_particles, isospin=isospin, ketwise=True).randomize(seed=next(seeder)).to_manybody_basis()
     bra = ket.copy().dagger()
     
@@ -216,7 +216,7 @@ def gfmc_3bprop(n_particles, dt, seed):
 
 def three_body_comms():
     n_particles = 3
-    sig = [[HilbertOperator(n_particles, isospin=isospin).apply_sigma(i,a) for a in [0, 1, 2]] for i in range(n_particles)]
+    sig = [[operator_bank.sigma(n_particles, i, a, isospin=isospin) for a in [0, 1, 2]] for i in range(n_particles)]
     # tau = [[GFMCSpinIsospinOperator(n_particles).apply_tau(i,a) for a in [0, 1, 2]] for i in range(n_particles)]
     o_0 = sig[0][0] * sig[1][0] * sig[2][0]
     o_1 = sig[0][1] * sig[1][1] * sig[2][1]
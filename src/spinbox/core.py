@@ -26,10 +26,24 @@ np.set_printoptions(linewidth=200)
 import matplotlib.pyplot as plt
 from scipy.linalg import expm
 from functools import reduce
+from collections import OrderedDict
 # from dataclasses import dataclass
 import itertools
-from multiprocessing.pool import Pool
+import os
+from multiprocessing.pool import Pool, ThreadPool
+from multiprocessing import shared_memory, resource_tracker
+import copy
+import pickle
+import hashlib
+import time
+import threading
+import warnings
+from contextlib import contextmanager
 from tqdm import tqdm
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
 
 # safe mode
 SAFE = False
@@ -146,6 +160,71 @@ def repeated_kronecker_product(matrices: list):
     return np.array(reduce(np.kron, matrices), dtype=complex)
 
 
+def exp_matrix(matrix: np.ndarray):
+    """matrix exponential that uses the closed form when the square of the matrix is a multiple of the identity
+
+    For M^2 = s^2 (e.g. a multiple of a Pauli string), exp(M) = cosh(s) + sinh(s)/s M, which costs O(dim^2) rather than 
+    the O(dim^3) of scipy.linalg.expm. The condition is checked on a random vector, which is also O(dim^2).
+    """
+    rng = np.random.default_rng(seed=0)
+    v = rng.standard_normal(matrix.shape[0]) + 1.j*rng.standard_normal(matrix.shape[0])
+    w = matrix @ (matrix @ v)
+    alpha = np.vdot(v, w) / np.vdot(v, v)
+    if np.linalg.norm(w - alpha * v) > 1e-13 * max(np.linalg.norm(w), np.linalg.norm(v)):
+        return expm(matrix)
+    sq = csqrt(alpha)
+    if sq == 0:
+        return np.identity(matrix.shape[0], dtype=complex) + matrix
+    return ccosh(sq) * np.identity(matrix.shape[0], dtype=complex) + csinh(sq) / sq * matrix
+
+
+def apply_local_matrix(coefficients: np.ndarray, matrix: np.ndarray, indices: list, n_particles: int, n_basis: int):
+    """applies a matrix acting on a few particles to many-body coefficients without forming the full operator
+
+    This is the primitive behind HilbertState.apply_local_operator, HilbertOperator.apply_onebody_operator and LocalHilbertOperator.
+    A batch of kets can be handled at once by stacking them as the columns of coefficients.
+
+    Args:
+        coefficients (np.ndarray): shape (n_basis**n_particles, ...), trailing axes are treated as a batch
+        matrix (np.ndarray): shape (n_basis**k, n_basis**k), ordered like repeated_kronecker_product over indices
+        indices (list): the k particles acted on, in any order
+
+    Returns:
+        numpy.array of the same shape as coefficients
+    """
+    k = len(indices)
+    psi = coefficients.reshape((n_basis,) * n_particles + coefficients.shape[1:])
+    gate = matrix.reshape((n_basis,) * (2*k))
+    out = np.tensordot(gate, psi, axes=(list(range(k, 2*k)), list(indices)))
+    out = np.moveaxis(out, list(range(k)), list(indices))
+    return out.reshape(coefficients.shape)
+
+
+def pack_aux(h):
+    """binary auxiliary fields of shape (..., n_aux) as packed bits (np.packbits layout) of shape (..., ceil(n_aux / 8))"""
+    return np.packbits(np.asarray(h, dtype=np.uint8), axis=-1)
+
+
+def unpack_aux(packed: np.ndarray, n_aux: int):
+    """the binary auxiliary fields held in packed bits, as integers"""
+    return np.unpackbits(packed, axis=-1, count=n_aux).astype(int)
+
+
+def packed_column(packed: np.ndarray, column: int):
+    """one column of binary auxiliary fields read straight from packed bits of shape (n_samples, n_bytes)"""
+    return ((packed[:, column >> 3] >> (7 - (column & 7))) & 1).astype(int)
+
+
+def counter_bits(keys: np.ndarray, counters: np.ndarray):
+    """64 random bits for every pair of keys (rows) and counters (columns), from the SplitMix64 finalizer applied to
+    key + (counter + 1) * golden gamma; any entry can be computed without the ones before it"""
+    counters = np.asarray(counters, dtype=np.uint64).reshape(1, -1)
+    z = keys.astype(np.uint64).reshape(-1, 1) + (counters + np.uint64(1)) * np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
 def pmat(x, heatmap=False, lims=None, print_zeros=False):
     """print and/or plot a complex matrix
     heatmat: plot a heatmap
@@ -237,12 +316,42 @@ class HilbertState:
     
     def multiply_operator(self, other):
         if SAFE:
-            assert isinstance(other, self.friendly_operator)
+            assert isinstance(other, (self.friendly_operator, LocalHilbertOperator))
             assert not self.ketwise
+        if isinstance(other, (LocalHilbertOperator, PauliStringOperator)):
+            return other.multiply_state(self)
         out = other.copy()
         out.coefficients = np.matmul(self.coefficients, other.coefficients, dtype='complex') 
         return out
     
+    def apply_local_operator(self, particle_indices: list, matrix: np.ndarray):
+        """ op |s> (or <s| op for a bra) for a matrix acting on a few particles
+        matrix has shape (n_basis**k, n_basis**k) for k = len(particle_indices); the full operator is never formed """
+        if SAFE:
+            assert matrix.shape == (self.n_basis**len(particle_indices), self.n_basis**len(particle_indices))
+        out = self.copy()
+        if self.ketwise:
+            out.coefficients = apply_local_matrix(self.coefficients, matrix, particle_indices, self.n_particles, self.n_basis)
+        else:
+            # <s| op = ( op^T |s>^T )^T
+            out.coefficients = apply_local_matrix(self.coefficients.T, matrix.T, particle_indices, self.n_particles, self.n_basis).T
+        return out
+
+    def apply_onebody_operator(self, particle_index: int, spin_matrix: np.ndarray, isospin_matrix=None):
+        if self.isospin:
+            if isospin_matrix is None:
+                isospin_matrix = np.identity(2, dtype=complex)
+            op = repeated_kronecker_product([isospin_matrix, spin_matrix])
+        else:
+            op = spin_matrix
+        return self.apply_local_operator([particle_index], op)
+
+    def apply_sigma(self, particle_index: int, dimension: int):
+        return self.apply_onebody_operator(particle_index=particle_index, spin_matrix=pauli(dimension), isospin_matrix=np.identity(2, dtype=complex) )
+
+    def apply_tau(self, particle_index: int, dimension: int):
+        return self.apply_onebody_operator(particle_index=particle_index, spin_matrix=np.identity(2, dtype=complex), isospin_matrix=pauli(dimension) )
+
     def dagger(self):
         """ copy-based conjugate transpose """
         out = self.copy()
@@ -329,7 +438,7 @@ class HilbertState:
                     return self.inner(other)
                 else:
                     raise ValueError("Improper multiplication.")
-            elif isinstance(other, HilbertOperator):
+            elif isinstance(other, (HilbertOperator, LocalHilbertOperator, PauliStringOperator)):
                 if not self.ketwise:
                     return self.multiply_operator(other)
             else:
@@ -338,27 +447,48 @@ class HilbertState:
     
 
 class HilbertOperator:
-    def __init__(self, n_particles: int, isospin=True):
+    def __init__(self, n_particles: int, isospin=True, coefficients=None):
         self.n_particles = n_particles
         self.isospin = isospin
         self.n_basis = 2 + 2*isospin
         self.dimension = self.n_basis ** self.n_particles
         self.dim = self.dimension
-        self.coefficients = np.identity(self.dim, dtype=complex)
+        if coefficients is None:
+            self.coefficients = np.identity(self.dim, dtype=complex)
+        else:
+            if coefficients.shape != (self.dim, self.dim):
+                raise ValueError("Inconsistent initialization of operator. \n\
+                                Did you get the shape right?")
+            self.coefficients = coefficients
         self.friendly_state = HilbertState
+        self.bank_id = None
 
     def copy(self):
-        out = HilbertOperator(n_particles=self.n_particles, isospin=self.isospin)
-        out.coefficients = self.coefficients.copy()
-        return out
+        return HilbertOperator(n_particles=self.n_particles, isospin=self.isospin, coefficients=np.array(self.coefficients, dtype=complex))
+
+    def __getstate__(self):
+        # operators from the shared bank are sent by reference, see OperatorBank
+        state = self.__dict__.copy()
+        if state.get('bank_id') is not None:
+            state['coefficients'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if state.get('bank_id') is not None:
+            self.coefficients = operator_bank.get(self.n_particles, self.bank_id, self.isospin).coefficients
     
     def __add__(self, other):
+        if isinstance(other, (LocalHilbertOperator, PauliStringOperator)):
+            other = other.to_manybody_basis()
         if SAFE: assert type(other) == type(self)
         out = self.copy()
         out.coefficients = self.coefficients + other.coefficients
         return out
 
     def __sub__(self, other):
+        if isinstance(other, (LocalHilbertOperator, PauliStringOperator)):
+            other = other.to_manybody_basis()
         if SAFE: assert type(other) == type(self)
         out = self.copy()
         out.coefficients = self.coefficients - other.coefficients
@@ -371,6 +501,8 @@ class HilbertOperator:
         return out
         
     def multiply_operator(self, other):
+        if isinstance(other, (LocalHilbertOperator, PauliStringOperator)):
+            other = other.to_manybody_basis()
         if SAFE: assert isinstance(other, type(self))
         out = other.copy()
         out.coefficients = np.matmul(self.coefficients, out.coefficients, dtype=complex)
@@ -390,28 +522,29 @@ class HilbertOperator:
         out += "Re=\n" + re + "\nIm:\n" + im
         return out
 
+    def apply_local_operator(self, particle_indices: list, matrix: np.ndarray):
+        """ op * self for a matrix acting on a few particles, see apply_local_matrix """
+        if SAFE:
+            assert matrix.shape == (self.n_basis**len(particle_indices), self.n_basis**len(particle_indices))
+        out = self.copy()
+        out.coefficients = apply_local_matrix(self.coefficients, matrix, particle_indices, self.n_particles, self.n_basis)
+        return out
+
     def apply_onebody_operator(self, particle_index: int, spin_matrix: np.ndarray, isospin_matrix=None):
         if SAFE:
             assert type(spin_matrix) == np.ndarray
             assert spin_matrix.shape == (2,2)
-        obo = [np.identity(self.n_basis, dtype=complex) for _ in range(self.n_particles)]
         if self.isospin:
             if isospin_matrix is None:
                 isospin_matrix = np.identity(2, dtype=complex)
             else:
                 if SAFE:
-                    assert type(spin_matrix) == np.ndarray
-                    assert spin_matrix.shape == (2,2)        
+                    assert type(isospin_matrix) == np.ndarray
+                    assert isospin_matrix.shape == (2,2)
             op = repeated_kronecker_product([isospin_matrix, spin_matrix])
         else:
             op = spin_matrix
-        if SAFE:
-            assert op.shape == obo[particle_index].shape
-        obo[particle_index] = op
-        obo = repeated_kronecker_product(obo)
-        out = self.copy()
-        out.coefficients = np.matmul(obo, out.coefficients, dtype=complex)
-        return out
+        return self.apply_local_operator([particle_index], op)
         
     def apply_sigma(self, particle_index: int, dimension: int):
         return self.apply_onebody_operator(particle_index=particle_index, spin_matrix=pauli(dimension), isospin_matrix=np.identity(2, dtype=complex) )
@@ -420,10 +553,15 @@ class HilbertOperator:
         return self.apply_onebody_operator(particle_index=particle_index, spin_matrix=np.identity(2, dtype=complex), isospin_matrix=pauli(dimension) )
                 
     def exp(self):
+        """see exp_matrix for the closed form used when op^2 is a multiple of the identity"""
         out = self.copy()
-        out.coefficients = expm(out.coefficients)
+        out.coefficients = exp_matrix(out.coefficients)
         return out
 
+    def to_manybody_basis(self):
+        """ already in the many-body basis, for symmetry with the local and Pauli string operators"""
+        return self.copy()
+
     def zero(self):
         out = self.copy()
         out.coefficients = np.zeros_like(out.coefficients)
@@ -446,13 +584,453 @@ class HilbertOperator:
                     return self.multiply_state(other)
                 else:
                     raise ValueError("Improper multiplication.")
-            elif isinstance(other, HilbertOperator):
+            elif isinstance(other, (HilbertOperator, LocalHilbertOperator, PauliStringOperator)):
+                return self.multiply_operator(other)
+            else:
+                raise NotImplementedError("Unsupported multiply.")
+
+
+
+class LocalHilbertOperator:
+    def __init__(self, n_particles: int, indices=None, coefficients=None, isospin=True):
+        """an operator in the full many-body basis that is the identity on every particle except a few
+
+        Only the matrix on the touched particles is stored, of shape (n_basis**k, n_basis**k) for k = len(indices),
+        ordered like repeated_kronecker_product over the particles in indices. It is applied to states by 
+        contracting against the amplitude tensor, which costs O(n_basis**(A+k)) instead of O(n_basis**(2A)).
+
+        Args:
+            n_particles (int): number of particles
+            indices (list): particle indices acted on
+            coefficients (np.ndarray): matrix on those particles, identity if None
+            isospin (bool): whether the basis includes isospin
+
+        Raises:
+            ValueError: if the coefficients do not match the indices
+        """
+        self.n_particles = n_particles
+        self.isospin = isospin
+        self.n_basis = 2 + 2*isospin
+        self.dimension = self.n_basis ** self.n_particles
+        self.dim = self.dimension
+        self.friendly_state = HilbertState
+        self.indices = [] if indices is None else [int(i) for i in indices]
+        local_dim = self.n_basis ** len(self.indices)
+        if coefficients is None:
+            self.coefficients = np.identity(local_dim, dtype=complex)
+        else:
+            if coefficients.shape != (local_dim, local_dim):
+                raise ValueError("Inconsistent initialization of local operator. \n\
+                                Did you get the shape right?")
+            self.coefficients = coefficients.astype('complex')
+        self.bank_id = None
+
+    def copy(self):
+        return LocalHilbertOperator(n_particles=self.n_particles, indices=self.indices, coefficients=self.coefficients.copy(), isospin=self.isospin)
+
+    def _embed(self, indices: list):
+        """the matrix of self on a superset of its particles, ordered as in indices"""
+        extra = [i for i in indices if i not in self.indices]
+        order = self.indices + extra
+        m = len(indices)
+        out = np.kron(self.coefficients, np.identity(self.n_basis ** len(extra), dtype=complex))
+        perm = [order.index(i) for i in indices]
+        out = out.reshape((self.n_basis,) * (2*m)).transpose(perm + [m + p for p in perm])
+        return out.reshape(self.n_basis ** m, self.n_basis ** m)
+
+    def _union(self, other):
+        return self.indices + [i for i in other.indices if i not in self.indices]
+
+    def __add__(self, other):
+        if isinstance(other, HilbertOperator):
+            return self.to_manybody_basis() + other
+        if SAFE: assert type(other) == type(self)
+        indices = self._union(other)
+        return LocalHilbertOperator(self.n_particles, indices, self._embed(indices) + other._embed(indices), self.isospin)
+
+    def __sub__(self, other):
+        if isinstance(other, HilbertOperator):
+            return self.to_manybody_basis() - other
+        if SAFE: assert type(other) == type(self)
+        indices = self._union(other)
+        return LocalHilbertOperator(self.n_particles, indices, self._embed(indices) - other._embed(indices), self.isospin)
+
+    def multiply_state(self, other):
+        if SAFE: assert isinstance(other, self.friendly_state)
+        return other.apply_local_operator(self.indices, self.coefficients)
+
+    def multiply_operator(self, other):
+        if SAFE: assert isinstance(other, (type(self), HilbertOperator))
+        if isinstance(other, HilbertOperator):
+            return other.apply_local_operator(self.indices, self.coefficients)
+        indices = self._union(other)
+        return LocalHilbertOperator(self.n_particles, indices, np.matmul(self._embed(indices), other._embed(indices), dtype=complex), self.isospin)
+
+    def scale(self, other):
+        """ c * operator """
+        if SAFE: assert np.isscalar(other)
+        out = self.copy()
+        out.coefficients *= other
+        return out
+
+    def apply_onebody_operator(self, particle_index: int, spin_matrix: np.ndarray, isospin_matrix=None):
+        if self.isospin:
+            if isospin_matrix is None:
+                isospin_matrix = np.identity(2, dtype=complex)
+            op = repeated_kronecker_product([isospin_matrix, spin_matrix])
+        else:
+            op = spin_matrix
+        onebody = LocalHilbertOperator(self.n_particles, [particle_index], op, self.isospin)
+        return onebody.multiply_operator(self)
+
+    def apply_sigma(self, particle_index: int, dimension: int):
+        return self.apply_onebody_operator(particle_index=particle_index, spin_matrix=pauli(dimension), isospin_matrix=np.identity(2, dtype=complex) )
+
+    def apply_tau(self, particle_index: int, dimension: int):
+        return self.apply_onebody_operator(particle_index=particle_index, spin_matrix=np.identity(2, dtype=complex), isospin_matrix=pauli(dimension) )
+
+    def exp(self):
+        """exp( 1 x M ) = 1 x exp( M ), so only the local matrix is exponentiated
+        note this relies on self being the identity, not zero, on the other particles"""
+        out = self.copy()
+        out.coefficients = exp_matrix(out.coefficients)
+        return out
+
+    def zero(self):
+        out = self.copy()
+        out.coefficients = np.zeros_like(out.coefficients)
+        return out
+
+    def dagger(self):
+        """ copy-based conj transpose"""
+        out = self.copy()
+        out.coefficients = self.coefficients.conj().T
+        return out
+
+    def to_manybody_basis(self):
+        """the equivalent dense HilbertOperator, taken from the shared operator bank if self came from there"""
+        if self.bank_id is not None:
+            return operator_bank.get(self.n_particles, self.bank_id, self.isospin)
+        return HilbertOperator(n_particles=self.n_particles, isospin=self.isospin, coefficients=self._embed(list(range(self.n_particles))))
+
+    def __str__(self):
+        out = f"{self.__class__.__name__} on particles {self.indices}\n"
+        re = str(np.real(self.coefficients))
+        im = str(np.imag(self.coefficients))
+        out += "Re=\n" + re + "\nIm:\n" + im
+        return out
+
+    def __mul__(self, other):
+        if SAFE:
+            raise NotImplementedError("You cannot multiply with * in SAFE mode.")
+        else:
+            if np.isscalar(other): # scalar * op
+                return self.copy().scale(other)
+            elif isinstance(other, HilbertState):
+                if other.ketwise: # op |s>
+                    return self.multiply_state(other)
+                else:
+                    raise ValueError("Improper multiplication.")
+            elif isinstance(other, (HilbertOperator, LocalHilbertOperator)):
+                return self.multiply_operator(other)
+            else:
+                raise NotImplementedError("Unsupported multiply.")
+
+
+
+class PauliStringOperator:
+    def __init__(self, n_particles: int, isospin=True, terms=None):
+        """a sum of Pauli strings, sum_n c_n P_n, in the full many-body basis
+
+        Each string is a tensor product of spin and isospin Pauli matrices and is stored as a pair of bit masks (x, z) over 
+        the bits of the basis index, with P(x, z) = i^popcount(x & z) X^x Z^z. A string is a signed permutation matrix, 
+        so it is applied to a state in O(4^A), and products of strings are found with bitwise operations.
+
+        Args:
+            n_particles (int): number of particles
+            isospin (bool): whether the basis includes isospin
+            terms (dict): {(x, z): coefficient}, the identity if None
+        """
+        self.n_particles = n_particles
+        self.isospin = isospin
+        self.n_basis = 2 + 2*isospin
+        self.dimension = self.n_basis ** self.n_particles
+        self.dim = self.dimension
+        self.n_bits = (1 + isospin) * self.n_particles
+        self.friendly_state = HilbertState
+        if terms is None:
+            self.terms = {(0, 0): 1.0 + 0.j}
+        else:
+            self.terms = dict(terms)
+
+    def copy(self):
+        return PauliStringOperator(n_particles=self.n_particles, isospin=self.isospin, terms=self.terms)
+
+    def _onebody_masks(self, particle_index: int, dimension: int, isospin: bool):
+        """(x, z) masks of sigma (or tau if isospin) of one particle; the isospin bit is above the spin bit, as in kron(tau, sigma)"""
+        bit = (1 + self.isospin) * (self.n_particles - 1 - particle_index) + isospin
+        x = int(dimension in [0, 1]) << bit
+        z = int(dimension in [1, 2]) << bit
+        return x, z
+
+    @staticmethod
+    def _compose(p1, p2):
+        """P1 P2 = phase * P3, returns (P3, phase)"""
+        (x1, z1), (x2, z2) = p1, p2
+        x3, z3 = x1 ^ x2, z1 ^ z2
+        power = (x1 & z1).bit_count() + (x2 & z2).bit_count() - (x3 & z3).bit_count() + 2 * (z1 & x2).bit_count()
+        return (x3, z3), 1.j ** (power % 4)
+
+    def __add__(self, other):
+        if isinstance(other, HilbertOperator):
+            return self.to_manybody_basis() + other
+        if SAFE: assert type(other) == type(self)
+        out = self.copy()
+        for p, c in other.terms.items():
+            out.terms[p] = out.terms.get(p, 0.) + c
+        return out
+
+    def __sub__(self, other):
+        return self + other.scale(-1.0)
+
+    def scale(self, other):
+        """ c * operator """
+        if SAFE: assert np.isscalar(other)
+        return PauliStringOperator(self.n_particles, self.isospin, {p: other * c for p, c in self.terms.items()})
+
+    def zero(self):
+        return PauliStringOperator(self.n_particles, self.isospin, {})
+
+    @staticmethod
+    def _commute(p1, p2):
+        (x1, z1), (x2, z2) = p1, p2
+        return ((x1 & z2).bit_count() + (z1 & x2).bit_count()) % 2 == 0
+
+    def exp(self):
+        """every Pauli string squares to the identity, so exp( c P ) = cosh( c ) + sinh( c ) P
+        if all strings commute the exponential is the product of these, and is returned as a PauliStringOperator
+        otherwise this falls back to the dense exponential and returns a HilbertOperator"""
+        strings = [(p, c) for p, c in self.terms.items() if c != 0]
+        if not all(self._commute(p1, p2) for (p1, _), (p2, _) in itertools.combinations(strings, 2)):
+            return self.to_manybody_basis().exp()
+        out = PauliStringOperator(self.n_particles, self.isospin)
+        for p, c in strings:
+            if p == (0, 0):
+                factor = {p: cexp(c)}
+            else:
+                factor = {(0, 0): ccosh(c), p: csinh(c)}
+            out = out.multiply_operator(PauliStringOperator(self.n_particles, self.isospin, factor))
+        return out
+
+    def dagger(self):
+        """ every Pauli string is Hermitian, so only the coefficients are conjugated"""
+        return PauliStringOperator(self.n_particles, self.isospin, {p: np.conj(c) for p, c in self.terms.items()})
+
+    def multiply_operator(self, other):
+        if isinstance(other, HilbertOperator):
+            out = other.copy()
+            out.coefficients = self._apply(other.coefficients)
+            return out
+        if SAFE: assert type(other) == type(self)
+        out = self.zero()
+        for p1, c1 in self.terms.items():
+            for p2, c2 in other.terms.items():
+                p3, phase = self._compose(p1, p2)
+                out.terms[p3] = out.terms.get(p3, 0.) + phase * c1 * c2
+        return out
+
+    @staticmethod
+    def _parity(v: np.ndarray):
+        """popcount(v) mod 2 of every entry, by folding the bits onto the lowest one"""
+        v = v.copy()
+        shift = 32
+        while shift:
+            v ^= v >> shift
+            shift >>= 1
+        return v & 1
+
+    def _monomial(self, p):
+        """source indices and phases such that (P psi)[b] = phase[b] * psi[source[b]]
+        found in O(4^A) with one index XOR and one parity array, whatever the number of bits"""
+        x, z = p
+        source = np.arange(self.dim) ^ x
+        phase = 1.j ** ((x & z).bit_count() % 4) * (1 - 2*self._parity(source & z))
+        return source, phase
+
+    def _apply(self, coefficients: np.ndarray):
+        """applies the operator to coefficients of shape (dim, ...)"""
+        out = np.zeros(coefficients.shape, dtype=complex)
+        for p, c in self.terms.items():
+            source, phase = self._monomial(p)
+            out += c * phase.reshape((-1,) + (1,) * (coefficients.ndim - 1)) * coefficients[source]
+        return out
+
+    def multiply_state(self, other):
+        if SAFE: assert isinstance(other, self.friendly_state)
+        out = other.copy()
+        if other.ketwise:
+            out.coefficients = self._apply(other.coefficients)
+        else:
+            # <s| op = ( op^dagger |s> )^dagger
+            out.coefficients = self.dagger()._apply(other.coefficients.conj().T).conj().T
+        return out
+
+    def apply_sigma(self, particle_index: int, dimension: int):
+        p = self._onebody_masks(particle_index, dimension, isospin=False)
+        return PauliStringOperator(self.n_particles, self.isospin, {p: 1.}).multiply_operator(self)
+
+    def apply_tau(self, particle_index: int, dimension: int):
+        if SAFE: assert self.isospin
+        p = self._onebody_masks(particle_index, dimension, isospin=True)
+        return PauliStringOperator(self.n_particles, self.isospin, {p: 1.}).multiply_operator(self)
+
+    def to_manybody_basis(self):
+        """the equivalent dense HilbertOperator"""
+        out = np.zeros((self.dim, self.dim), dtype=complex)
+        rows = np.arange(self.dim)
+        for p, c in self.terms.items():
+            source, phase = self._monomial(p)
+            out[rows, source] += c * phase
+        return HilbertOperator(n_particles=self.n_particles, isospin=self.isospin, coefficients=out)
+
+    def __str__(self):
+        out = [f"{self.__class__.__name__} of {len(self.terms)} strings:"]
+        out += [f"{c} * P(x={x:b}, z={z:b})" for (x, z), c in self.terms.items()]
+        return "\n".join(out)
+
+    def __mul__(self, other):
+        if SAFE:
+            raise NotImplementedError("You cannot multiply with * in SAFE mode.")
+        else:
+            if np.isscalar(other): # scalar * op
+                return self.scale(other)
+            elif isinstance(other, HilbertState):
+                if other.ketwise: # op |s>
+                    return self.multiply_state(other)
+                else:
+                    raise ValueError("Improper multiplication.")
+            elif isinstance(other, (HilbertOperator, PauliStringOperator)):
                 return self.multiply_operator(other)
             else:
                 raise NotImplementedError("Unsupported multiply.")
 
 
 
+class _DiskTier:
+    """the optional on-disk tier of OperatorBank and ExactCache: .npy files in self.directory, which defaults to the
+    environment variable named by the class attribute environment"""
+    environment = None
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.environ.get(self.environment)
+        self.directory = directory
+
+    def set_directory(self, directory):
+        """enables the on-disk tier; the environment variable is set too so that spawned workers find the same files"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        os.environ[self.environment] = directory
+
+    def _write(self, filename, array):
+        """saves array through a temporary file and a rename, so other processes never see a partial file"""
+        temp = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, 'wb') as f:
+            np.save(f, array)
+        os.replace(temp, filename)
+
+
+class OperatorBank(_DiskTier):
+    """process-wide store of dense one-body operators, keyed by (n_particles, isospin, operator id)
+
+    operator ids are ('ident',), ('sigma', i, a) and ('tau', i, a)
+    dense operators are kept in memory up to memory_bytes, dropping the least recently used first.
+    if a directory is set (or the SPINBOX_BANK_DIR environment variable), each operator is written there once
+    and read back as a read-only np.memmap, so every process, including Pool workers, maps the same pages.
+    HilbertOperators from the bank are pickled by reference and re-fetched from the bank on the other side.
+    """
+    environment = 'SPINBOX_BANK_DIR'
+
+    def __init__(self, memory_bytes=2**30, directory=None):
+        super().__init__(directory)
+        self.memory_bytes = memory_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.RLock()
+
+    def clear(self):
+        self._memory = OrderedDict()
+        self._memory_size = 0
+
+    def _local(self, n_particles: int, operator_id: tuple, isospin: bool):
+        out = LocalHilbertOperator(n_particles, isospin=isospin)
+        if operator_id[0]=='sigma':
+            out = out.apply_sigma(operator_id[1], operator_id[2])
+        elif operator_id[0]=='tau':
+            out = out.apply_tau(operator_id[1], operator_id[2])
+        elif operator_id[0]!='ident':
+            raise ValueError(f'No option: {operator_id}')
+        return out
+
+    def _dense(self, n_particles: int, operator_id: tuple, isospin: bool):
+        """the dense matrix of operator_id, filled from its Pauli string (a signed permutation) instead of a Kronecker product"""
+        out = PauliStringOperator(n_particles, isospin=isospin)
+        if operator_id[0]=='sigma':
+            out = out.apply_sigma(operator_id[1], operator_id[2])
+        elif operator_id[0]=='tau':
+            out = out.apply_tau(operator_id[1], operator_id[2])
+        elif operator_id[0]!='ident':
+            raise ValueError(f'No option: {operator_id}')
+        return out.to_manybody_basis().coefficients
+
+    def _filename(self, key):
+        n_particles, isospin, operator_id = key
+        return os.path.join(self.directory, f"A{n_particles}_iso{int(isospin)}_{'_'.join(str(x) for x in operator_id)}.npy")
+
+    def local(self, n_particles: int, operator_id: tuple, isospin=True):
+        """the LocalHilbertOperator for operator_id; it densifies through this bank"""
+        out = self._local(n_particles, tuple(operator_id), isospin)
+        out.bank_id = tuple(operator_id)
+        return out
+
+    def get(self, n_particles: int, operator_id: tuple, isospin=True):
+        """the dense HilbertOperator for operator_id, whose coefficients are read-only"""
+        operator_id = tuple(operator_id)
+        key = (n_particles, isospin, operator_id)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                coefficients = self._memory[key]
+            else:
+                if self.directory is None:
+                    coefficients = self._dense(n_particles, operator_id, isospin)
+                    coefficients.flags.writeable = False
+                else:
+                    filename = self._filename(key)
+                    if not os.path.exists(filename):
+                        self._write(filename, self._dense(n_particles, operator_id, isospin))
+                    coefficients = np.load(filename, mmap_mode='r')
+                if coefficients.nbytes <= self.memory_bytes:
+                    while self._memory_size + coefficients.nbytes > self.memory_bytes:
+                        _, old = self._memory.popitem(last=False)
+                        self._memory_size -= old.nbytes
+                    self._memory[key] = coefficients
+                    self._memory_size += coefficients.nbytes
+        out = HilbertOperator(n_particles, isospin=isospin, coefficients=coefficients)
+        out.bank_id = operator_id
+        return out
+
+    def sigma(self, n_particles: int, particle_index: int, dimension: int, isospin=True):
+        return self.get(n_particles, ('sigma', particle_index, dimension), isospin)
+
+    def tau(self, n_particles: int, particle_index: int, dimension: int, isospin=True):
+        return self.get(n_particles, ('tau', particle_index, dimension), isospin)
+
+
+operator_bank = OperatorBank()
+
+
+
 # ONE-BODY BASIS CLASSES
         
 
@@ -518,6 +1096,20 @@ class ProductState:
             out.coefficients[i] = np.matmul(self.coefficients[i], other.coefficients[i], dtype=complex)
         return out
 
+    def multiply_operator(self, other):
+        """<bra| op, for a ProductOperator or a LocalProductOperator"""
+        if SAFE:
+            assert isinstance(other, (self.friendly_operator, LocalProductOperator))
+            assert not self.ketwise
+        out = self.copy()
+        if isinstance(other, LocalProductOperator):
+            for n, i in enumerate(other.indices):
+                out.coefficients[i] = np.matmul(out.coefficients[i], other.coefficients[n], dtype=complex)
+        else:
+            for i in range(self.n_particles):
+                out.coefficients[i] = np.matmul(out.coefficients[i], other.coefficients[i], dtype=complex)
+        return out
+
     def dagger(self):
         """ copy_based conj transpose"""
         out = self.copy()
@@ -594,7 +1186,7 @@ class ProductState:
                     return self.inner(other)
                 else:
                     raise ValueError("Improper multiplication.")
-            elif isinstance(other, ProductOperator):
+            elif isinstance(other, (ProductOperator, LocalProductOperator)):
                 if not self.ketwise:
                     return self.multiply_operator(other)
             else:
@@ -620,14 +1212,22 @@ class ProductOperator:
         return [self.coefficients[i] for i in range(self.n_particles)]
         
     def multiply_state(self, other):
-        if SAFE: assert isinstance(other, self.friendly_state)
+        """acts on a ProductState, or on a HilbertState one particle at a time without forming the kronecker product"""
+        if SAFE: assert isinstance(other, (self.friendly_state, HilbertState))
+        if isinstance(other, HilbertState):
+            out = other
+            for i in range(self.n_particles):
+                out = out.apply_local_operator([i], self.coefficients[i])
+            return out
         out = other.copy()
         for i in range(self.n_particles):
                 out.coefficients[i] = np.matmul(self.coefficients[i], out.coefficients[i], dtype=complex)
         return out
         
     def multiply_operator(self, other):
-        if SAFE: assert isinstance(other, type(self))
+        if SAFE: assert isinstance(other, (type(self), LocalProductOperator))
+        if isinstance(other, LocalProductOperator):
+            other = other.to_product_operator()
         out = other.copy()
         for i in range(self.n_particles):
                 out.coefficients[i] = np.matmul(self.coefficients[i], out.coefficients[i], dtype=complex)
@@ -703,28 +1303,173 @@ class ProductOperator:
                     return self.multiply_state(other)
                 else:
                     raise ValueError("Improper multiplication.")
-            elif isinstance(other, ProductOperator):
+            elif isinstance(other, (ProductOperator, LocalProductOperator)):
                 return self.multiply_operator(other)
             else:
                 raise NotImplementedError("Unsupported multiply.")
 
     
 
-# COUPLINGS / POTENTIALS
+class LocalProductOperator:
+    def __init__(self, n_particles: int, indices=None, coefficients=None, isospin=True):
+        """a product operator that is the identity on every particle except a few
 
-class Coupling:
-    def __init__(self, n_particles, shape, file=None):
-        self.n_particles = n_particles
-        self.shape = shape
-        self.coefficients = np.zeros(shape=self.shape)
-        if file is not None:
-            self.read(file)
+        Only the touched particles are stored, so multiplying a state costs O(len(indices)) rather than O(A).
 
-    def copy(self):
-        if SAFE: assert isinstance(self.coefficients, np.ndarray)
-        out = Coupling(self.n_particles, self.shape)
-        out.coefficients = self.coefficients.copy()
-        return out
+        Args:
+            n_particles (int): number of particles
+            indices (list): particle indices acted on
+            coefficients (np.ndarray): single particle matrices of shape (len(indices), n_basis, n_basis), identities if None
+            isospin (bool): whether the basis includes isospin
+
+        Raises:
+            ValueError: if the coefficients do not match the indices
+        """
+        self.n_particles = n_particles
+        self.isospin = isospin
+        self.n_basis = 2 + 2*isospin
+        self.friendly_state = ProductState
+        self.indices = [] if indices is None else [int(i) for i in indices]
+        if coefficients is None:
+            self.coefficients = np.array(len(self.indices)*[np.identity(self.n_basis)], dtype=complex).reshape(len(self.indices), self.n_basis, self.n_basis)
+        else:
+            if coefficients.shape != (len(self.indices), self.n_basis, self.n_basis):
+                raise ValueError("Inconsistent initialization of local operator. \n\
+                                Did you get the shape right?")
+            self.coefficients = coefficients.astype('complex')
+
+    def copy(self):
+        return LocalProductOperator(n_particles=self.n_particles, indices=self.indices, coefficients=self.coefficients.copy(), isospin=self.isospin)
+
+    def to_list(self):
+        return self.to_product_operator().to_list()
+
+    def to_product_operator(self):
+        """the equivalent full-width ProductOperator"""
+        out = ProductOperator(n_particles=self.n_particles, isospin=self.isospin)
+        for n, i in enumerate(self.indices):
+            out.coefficients[i] = np.matmul(self.coefficients[n], out.coefficients[i], dtype=complex)
+        return out
+
+    def multiply_state(self, other):
+        """acts on a ProductState, or on a HilbertState one particle at a time"""
+        if SAFE: assert isinstance(other, (self.friendly_state, HilbertState))
+        if isinstance(other, HilbertState):
+            out = other
+            for n, i in enumerate(self.indices):
+                out = out.apply_local_operator([i], self.coefficients[n])
+            return out
+        out = other.copy()
+        for n, i in enumerate(self.indices):
+            out.coefficients[i] = np.matmul(self.coefficients[n], out.coefficients[i], dtype=complex)
+        return out
+
+    def multiply_operator(self, other):
+        if SAFE: assert isinstance(other, (type(self), ProductOperator))
+        if isinstance(other, ProductOperator):
+            out = other.copy()
+            for n, i in enumerate(self.indices):
+                out.coefficients[i] = np.matmul(self.coefficients[n], out.coefficients[i], dtype=complex)
+        else:
+            out = other.copy()
+            for n, i in enumerate(self.indices):
+                out = out.apply_onebody_matrix(i, self.coefficients[n])
+        return out
+
+    def apply_onebody_matrix(self, particle_index: int, onebody_matrix: np.ndarray):
+        """left-multiply the matrix on one particle by a (n_basis, n_basis) matrix, adding the particle if needed"""
+        out = self.copy()
+        if particle_index in out.indices:
+            n = out.indices.index(particle_index)
+            out.coefficients[n] = np.matmul(onebody_matrix, out.coefficients[n], dtype=complex)
+        else:
+            out.indices.append(int(particle_index))
+            out.coefficients = np.concatenate([out.coefficients, np.array(onebody_matrix, dtype=complex).reshape(1, self.n_basis, self.n_basis)])
+        return out
+
+    def apply_onebody_operator(self, particle_index: int, spin_matrix: np.ndarray, isospin_matrix=None):
+        if self.isospin:
+            if isospin_matrix is None:
+                isospin_matrix = np.identity(2, dtype=complex)
+            onebody_matrix = repeated_kronecker_product([isospin_matrix, spin_matrix])
+        else:
+            onebody_matrix = spin_matrix
+        return self.apply_onebody_matrix(particle_index, onebody_matrix)
+
+    def apply_sigma(self, particle_index, dimension):
+        return self.apply_onebody_operator(particle_index=particle_index,
+                                          isospin_matrix=np.identity(2, dtype=complex),
+                                          spin_matrix=pauli(dimension))
+
+    def apply_tau(self, particle_index, dimension):
+        return self.apply_onebody_operator(particle_index=particle_index,
+                                          isospin_matrix=pauli(dimension),
+                                          spin_matrix=np.identity(2, dtype=complex))
+
+    def scale_one(self, particle_index: int, b):
+        if SAFE: assert np.isscalar(b)
+        return self.apply_onebody_matrix(particle_index, b * np.identity(self.n_basis))
+
+    def scale_all(self, b):
+        """scalars commute with everything, so b is absorbed into a single particle"""
+        if SAFE: assert np.isscalar(b)
+        if len(self.indices)==0:
+            return self.scale_one(0, b)
+        out = self.copy()
+        out.coefficients[0] *= b
+        return out
+
+    def dagger(self):
+        """ conj transpose"""
+        out = self.copy()
+        out.coefficients = np.transpose(self.coefficients, axes=(0,2,1)).conj()
+        return out
+
+    def __str__(self):
+        out = f"{self.__class__.__name__}\n"
+        for i, op in zip(self.indices, self.coefficients):
+            re = str(np.real(op))
+            im = str(np.imag(op))
+            out += f"Op {i} Re:\n" + re + f"\nOp {i} Im:\n" + im + "\n"
+        return out
+
+    def to_manybody_basis(self):
+        """project the local operator into the full many-body configuration basis"""
+        return self.to_product_operator().to_manybody_basis()
+
+    def __mul__(self, other):
+        if SAFE:
+            raise NotImplementedError("You cannot multiply with * in SAFE mode.")
+        else:
+            if np.isscalar(other): # scalar * op
+                return self.copy().scale_all(other)
+            elif isinstance(other, ProductState):
+                if other.ketwise: # op |s>
+                    return self.multiply_state(other)
+                else:
+                    raise ValueError("Improper multiplication.")
+            elif isinstance(other, (ProductOperator, LocalProductOperator)):
+                return self.multiply_operator(other)
+            else:
+                raise NotImplementedError("Unsupported multiply.")
+
+
+
+# COUPLINGS / POTENTIALS
+
+class Coupling:
+    def __init__(self, n_particles, shape, file=None):
+        self.n_particles = n_particles
+        self.shape = shape
+        self.coefficients = np.zeros(shape=self.shape)
+        if file is not None:
+            self.read(file)
+
+    def copy(self):
+        if SAFE: assert isinstance(self.coefficients, np.ndarray)
+        out = Coupling(self.n_particles, self.shape)
+        out.coefficients = self.coefficients.copy()
+        return out
 
     def __mul__(self, other):
         if SAFE: assert np.isscalar(other)
@@ -963,121 +1708,354 @@ class ArgonnePotential:
 # PROPAGATOR CLASSES
 
 class Propagator:
-    def __init__(self, n_particles, dt, isospin=True, include_prefactors=True):
+    """ if rank1_spinorbit, the twobody spin-orbit factors use that
+        sum_{i<j} g_ai g_bj sigma_ai sigma_bj = 1/2 O^2 - 1/2 sum g^2 ,   O = sum_ai g_ai sigma_ai
+    and are replaced by the single factor exp( x O / sqrt(2) ), with one auxiliary field instead of 9 per pair
+    """
+    def __init__(self, n_particles, dt, isospin=True, include_prefactors=True, rank1_spinorbit=False):
         self.n_particles = n_particles
         self.dt = dt
         self.include_prefactors = include_prefactors
         self.isospin = isospin
+        self.rank1_spinorbit = rank1_spinorbit
         self._xyz = [0, 1, 2]
         self._1b_idx = interaction_indices(n_particles, 1)
         self._2b_idx = interaction_indices(n_particles, 2)
         self._3b_idx = interaction_indices(n_particles, 3)
         self._n2 = len(self._2b_idx)
         self._n3 = len(self._3b_idx)
+        self._live = {}
+
+    def aux_strengths(self, channel: str, coupling: Coupling):
+        """for each auxiliary field of a channel (full layout, in aux order), a bound on the exponent of the averaged factor
+        for the pair factors exp( - k op_i op_j ) this is |k|"""
+        if channel=='sigma':
+            k = [0.5 * self.dt * coupling[a,i,b,j] for i,j in self._2b_idx for a in self._xyz for b in self._xyz]
+        elif channel=='sigmatau':
+            k = [0.5 * self.dt * coupling[a,i,b,j] for i,j in self._2b_idx for a in self._xyz for b in self._xyz for c in self._xyz]
+        elif channel=='tau':
+            k = [0.5 * self.dt * coupling[i,j] for i,j in self._2b_idx for a in self._xyz]
+        elif channel=='coulomb':
+            k = [0.125 * self.dt * coupling[i,j] for i,j in self._2b_idx]
+        elif channel=='spinorbit' and self.rank1_spinorbit:
+            (_, k, ops, s), _ = self.spinorbit_mode(coupling)
+            k = [0.5 * k * np.sum(s)**2]
+        elif channel=='spinorbit':
+            k = [- 0.5 * coupling[a, i] * coupling[b, j] for i,j in self._2b_idx for a in self._xyz for b in self._xyz]
+        return np.abs(np.array(k))
+
+    def prune(self, potential: ArgonnePotential, sigma=False, sigmatau=False, tau=False, coulomb=False, spinorbit=False, threshold=0.0):
+        """skips the sampled factors whose strength (see aux_strengths) is at most threshold, for the chosen channels of this potential
+        afterwards factors_*() and terms() take the auxiliary fields of those channels in the compressed layout (live fields only)
+        a skipped factor is replaced by its value at zero coupling (the identity, up to the constant normalization of
+        HilbertPropagatorRBM); it was within exp(strength) - 1 of that, so the averaged propagator changes by at most
+            exp( sum of the skipped strengths ) - 1
+        times the product of the norms of the kept factors; this bound is returned (0 if threshold=0, nothing changes then)
+        calling prune without channels undoes any pruning"""
+        self._live = {}
+        skipped = 0.
+        for channel, flag in zip(['sigma', 'sigmatau', 'tau', 'coulomb', 'spinorbit'], [sigma, sigmatau, tau, coulomb, spinorbit]):
+            if flag:
+                coupling = getattr(potential, channel)
+                strengths = self.aux_strengths(channel, coupling)
+                live = strengths > threshold
+                self._live[(channel, coupling.coefficients.tobytes())] = live
+                skipped += np.sum(strengths[~live])
+        return np.expm1(skipped)
+
+    def live_mask(self, channel: str, coupling: Coupling):
+        """boolean mask of the live auxiliary fields of a channel in the full layout, None if the channel is not pruned"""
+        return self._live.get((channel, coupling.coefficients.tobytes()))
+
+    def _expand_aux(self, channel: str, coupling: Coupling, aux):
+        """aux in the full layout of a channel (skipped entries set to 0) and the live mask
+        aux may be given in either the compressed or the full layout"""
+        live = self.live_mask(channel, coupling)
+        if live is None:
+            return aux, np.ones(len(aux), dtype=bool)
+        if len(aux)==len(live):
+            return aux, live
+        full = np.zeros(len(live), dtype=np.asarray(aux).dtype)
+        full[live] = aux
+        return full, live
+
+    def mode_sample(self, k: complex, x, ops: np.ndarray, s: np.ndarray, balance=False):
+        """exp( x sqrt(-k) sum_i ops_i ) as a ProductOperator, using ops_i^2 = s_i^2
+        if balance, returns the factors for x and -x, which share the cosh and sinh"""
+        arg = csqrt(-k)*x
+        plus = ProductOperator(self.n_particles, self.isospin)
+        minus = ProductOperator(self.n_particles, self.isospin)
+        for i in self._1b_idx:
+            if s[i]!=0:
+                even = ccosh(arg*s[i]) * np.identity(ops.shape[-1])
+                odd = csinh(arg*s[i]) / s[i] * ops[i]
+                plus.coefficients[i] = even + odd
+                minus.coefficients[i] = even - odd
+        return (plus, minus) if balance else plus
+
+    def _fixed_factor(self, factor, balance: bool):
+        """a factor that does not depend on the auxiliary fields, paired with itself if balance"""
+        return (factor, factor) if balance else factor
+
+    def _onebody_matrices(self):
+        """single particle sigma and tau matrices (tau is None without isospin)"""
+        if self.isospin:
+            sig = [repeated_kronecker_product([np.identity(2), pauli(a)]) for a in self._xyz]
+            tau = [repeated_kronecker_product([pauli(a), np.identity(2)]) for a in self._xyz]
+        else:
+            sig = pauli('list')
+            tau = None
+        return sig, tau
+
+    def fixed_terms(self, channel: str, coupling: Coupling):
+        """the factors of a channel that do not depend on the auxiliary fields, as ('onebody', k, i, op) and ('scale', c) terms
+        (see ProductPropagator); only the coulomb and spinorbit channels have any"""
+        sig, tau = self._onebody_matrices()
+        out = []
+        if channel=='coulomb':
+            for i,j in self._2b_idx:
+                k = 0.125 * self.dt * coupling[i,j]
+                if self.include_prefactors:
+                    out.append( ('scale', cexp(-k)) )
+                out.append( ('onebody', k, i, tau[2]) )
+                out.append( ('onebody', k, j, tau[2]) )
+        elif channel=='spinorbit':
+            for i in self._1b_idx:
+                for a in self._xyz:
+                    out.append( ('onebody', 1.j * coupling[a,i], i, sig[a]) )
+            if self.include_prefactors and self.rank1_spinorbit:
+                out.append( ('scale', self.spinorbit_mode(coupling)[1]) )
+            elif self.include_prefactors:
+                out.append( ('scale', np.exp( 0.5 * np.sum(coupling.coefficients**2))) )
+        return out
+
+    def fixed_factors(self, channel: str, coupling: Coupling):
+        """fixed_terms as LocalProductOperators, which act on ProductStates and HilbertStates alike"""
+        out = []
+        for term in self.fixed_terms(channel, coupling):
+            if term[0]=='onebody':
+                _, k, i, op = term
+                g = ccosh(k) * np.identity(len(op)) - csinh(k) * op
+                out.append( LocalProductOperator(self.n_particles, [i], g.reshape(1, *g.shape), self.isospin) )
+            elif term[0]=='scale':
+                out.append( LocalProductOperator(self.n_particles, isospin=self.isospin).scale_all(term[1]) )
+        return out
+
+    def fixed_operator(self, channel: str, coupling: Coupling):
+        """the fixed factors of a channel composed in order into one ProductOperator"""
+        out = ProductOperator(self.n_particles, self.isospin)
+        for factor in self.fixed_factors(channel, coupling):
+            out = factor.multiply_operator(out)
+        return out
+
+    def spinorbit_mode(self, coupling: Coupling):
+        """the rank-1 twobody spin-orbit term ('mode', -1/2, ops, s) with ops_i = sum_a g_ai sigma_a, and its normalization
+        for a gaussian field the factor averages to exp( O^2 / 4 ); for a binary field to cosh( O / sqrt(2) ), the same to O(g^4)"""
+        sig, _ = self._onebody_matrices()
+        ops = np.array([sum(coupling[a, i] * sig[a] for a in self._xyz) for i in self._1b_idx], dtype=complex)
+        s = np.sqrt(np.sum(coupling.coefficients**2, axis=0))
+        return ('mode', -0.5, ops, s), np.exp( 0.25 * np.sum(coupling.coefficients**2))
 
 
 class HilbertPropagatorHS(Propagator):
-    """ exp( - k op_i op_j )"""
-    def __init__(self, n_particles, dt, isospin=True, include_prefactors=True):
-        super().__init__(n_particles, dt, isospin, include_prefactors)
-        self._ident = HilbertOperator(self.n_particles, isospin=isospin)
-        self._sig_op = [[HilbertOperator(self.n_particles, isospin=isospin).apply_sigma(i,a) for a in [0, 1, 2]] for i in range(self.n_particles)]
-        self._tau_op = [[HilbertOperator(self.n_particles, isospin=isospin).apply_tau(i,a) for a in [0, 1, 2]] for i in range(self.n_particles)]
+    """ exp( - k op_i op_j )
+    if matrix_free, the factors are LocalHilbertOperators and no 4^A x 4^A matrix is ever formed
+    """
+    def __init__(self, n_particles, dt, isospin=True, include_prefactors=True, matrix_free=False, rank1_spinorbit=False):
+        super().__init__(n_particles, dt, isospin, include_prefactors, rank1_spinorbit)
+        self.matrix_free = matrix_free
+        if matrix_free:
+            self._ident = LocalHilbertOperator(self.n_particles, isospin=isospin)
+        else:
+            self._ident = operator_bank.get(self.n_particles, ('ident',), isospin)
+        # the banks are local and only densified (through the shared operator_bank) when combined with a dense operator
+        self._sig_op = [[operator_bank.local(self.n_particles, ('sigma', i, a), isospin) for a in [0, 1, 2]] for i in range(self.n_particles)]
+        self._tau_op = [[operator_bank.local(self.n_particles, ('tau', i, a), isospin) for a in [0, 1, 2]] for i in range(self.n_particles)]
         self.n_aux_sigma = 9 * self._n2
         self.n_aux_sigmatau = 27 * self._n2
         self.n_aux_tau = 3 * self._n2
         self.n_aux_coulomb = 1 * self._n2
-        self.n_aux_spinorbit = 9 * self._n2
+        self.n_aux_spinorbit = 1 if rank1_spinorbit else 9 * self._n2
 
     def onebody(self, k: complex, operator: HilbertOperator):
         """exp (- k opi)"""
         return operator.scale(-k).exp()        
 
-    def twobody_sample(self, k: complex, x: float, operator_i: HilbertOperator, operator_j: HilbertOperator):
-        """ exp( x sqrt( -k ) opi ) * exp( x sqrt( -k ) opj ) """
+    def twobody_sample(self, k: complex, x: float, operator_i: HilbertOperator, operator_j: HilbertOperator, balance=False):
+        """ exp( x sqrt( -k ) opi ) * exp( x sqrt( -k ) opj )
+        built from its even and odd parts in x, c^2 + s^2 opi opj and c s (opi + opj), so that if balance the factor for -x
+        is returned too at the cost of one more sum"""
         arg = csqrt(-k)*x
         if self.include_prefactors:
             prefactor = cexp(k)
         else:
             prefactor = 1.0
-        gi = self._ident.scale(ccosh(arg)) + operator_i.scale(csinh(arg))
-        gj = self._ident.scale(ccosh(arg)) + operator_j.scale(csinh(arg))
-        return gi.multiply_operator(gj).scale(prefactor)
-                
-    def factors_sigma(self, coupling: Coupling, aux: list):
+        c, s = ccosh(arg), csinh(arg)
+        even = self._ident.scale(prefactor * c * c) + operator_i.multiply_operator(operator_j).scale(prefactor * s * s)
+        odd = (operator_i + operator_j).scale(prefactor * c * s)
+        if balance:
+            return even + odd, even - odd
+        return even + odd
+
+    def factors_sigma(self, coupling: Coupling, aux: list, balance=False):
+        """if balance, returns the pairs of factors for aux and for the flipped fields (see Integrator.bracket_balanced)"""
         out = []
         idx = 0
+        aux, live = self._expand_aux('sigma', coupling, aux)
         for i,j in self._2b_idx:
             for a in self._xyz:
                 for b in self._xyz:
                     k = 0.5 * self.dt * coupling[a,i,b,j]
-                    out.append( self.twobody_sample(k, aux[idx], self._sig_op[i][a], self._sig_op[j][b]) )
+                    if live[idx]:
+                        out.append( self.twobody_sample(k, aux[idx], self._sig_op[i][a], self._sig_op[j][b], balance) )
                     idx += 1
         return out
 
-    def factors_sigmatau(self, coupling: Coupling,  aux: list):
+    def factors_sigmatau(self, coupling: Coupling,  aux: list, balance=False):
         out = []
         idx = 0
+        aux, live = self._expand_aux('sigmatau', coupling, aux)
         for i,j in self._2b_idx:
             for a in self._xyz:
                 for b in self._xyz:
                     for c in self._xyz:
                         k = 0.5 * self.dt * coupling[a,i,b,j]
-                        opi = self._sig_op[i][a].multiply_operator(self._tau_op[i][c])
-                        opj = self._sig_op[j][b].multiply_operator(self._tau_op[j][c])
-                        out.append( self.twobody_sample(k, aux[idx], opi, opj) )
+                        if live[idx]:
+                            opi = self._sig_op[i][a].multiply_operator(self._tau_op[i][c])
+                            opj = self._sig_op[j][b].multiply_operator(self._tau_op[j][c])
+                            out.append( self.twobody_sample(k, aux[idx], opi, opj, balance) )
                         idx += 1
         return out
     
-    def factors_tau(self, coupling: Coupling, aux: list):
+    def factors_tau(self, coupling: Coupling, aux: list, balance=False):
         out = []
         idx = 0
+        aux, live = self._expand_aux('tau', coupling, aux)
         for i,j in self._2b_idx:
             for a in self._xyz:
                     k = 0.5 * self.dt * coupling[i,j]
-                    out.append( self.twobody_sample(k, aux[idx], self._tau_op[i][a], self._tau_op[j][a]) )
+                    if live[idx]:
+                        out.append( self.twobody_sample(k, aux[idx], self._tau_op[i][a], self._tau_op[j][a], balance) )
+                    idx += 1
         return out
 
-    def factors_coulomb(self, coupling: Coupling, aux: list):
+    def factors_coulomb(self, coupling: Coupling, aux: list, fixed=True, balance=False):
+        """if not fixed, the factors that do not depend on aux (see fixed_terms) are left out"""
         out = []
         idx = 0
+        aux, live = self._expand_aux('coulomb', coupling, aux)
         for i,j in self._2b_idx:
                 k = 0.125 * self.dt * coupling[i,j]
-                if self.include_prefactors:
-                    out.append(HilbertOperator(self.n_particles, self.isospin).scale(cexp(-k)))
-                out.append( self.onebody(k, self._tau_op[i][2]) )
-                out.append( self.onebody(k, self._tau_op[j][2]) )
-                out.append( self.twobody_sample(k, aux[idx], self._tau_op[i][2], self._tau_op[j][2]) )
+                if fixed and self.include_prefactors:
+                    out.append( self._fixed_factor(self._ident.scale(cexp(-k)), balance) )
+                if fixed:
+                    out.append( self._fixed_factor(self.onebody(k, self._tau_op[i][2]), balance) )
+                    out.append( self._fixed_factor(self.onebody(k, self._tau_op[j][2]), balance) )
+                if live[idx]:
+                    out.append( self.twobody_sample(k, aux[idx], self._tau_op[i][2], self._tau_op[j][2], balance) )
                 idx += 1
         return out
     
-    def factors_spinorbit(self, coupling: Coupling, aux: list):
+    def factors_spinorbit(self, coupling: Coupling, aux: list, fixed=True, balance=False):
+        """if not fixed, the factors that do not depend on aux (see fixed_terms) are left out"""
         out = []
         idx = 0
+        aux, live = self._expand_aux('spinorbit', coupling, aux)
         for i in self._1b_idx:
             for a in self._xyz:
                 k = 1.j * coupling[a,i]
-                out.append( self.onebody(k,  self._sig_op[i][a])  )
+                if fixed:
+                    out.append( self._fixed_factor(self.onebody(k,  self._sig_op[i][a]), balance) )
+        if self.rank1_spinorbit:
+            (_, k, ops, s), prefactor = self.spinorbit_mode(coupling)
+            if live[0]:
+                factor = self.mode_sample(k, aux[0], ops, s, balance)
+                if not self.matrix_free:
+                    factor = tuple(f.to_manybody_basis() for f in factor) if balance else factor.to_manybody_basis()
+                out.append( factor )
+            if fixed and self.include_prefactors:
+                out.append( self._fixed_factor(self._ident.scale(prefactor), balance) )
+            return out
         for i,j in self._2b_idx:
             for a in self._xyz:
                 for b in self._xyz:
                     k = - 0.5 * coupling[a, i] * coupling[b, j] 
-                    out.append( self.twobody_sample(k, aux[idx], self._sig_op[i][a], self._sig_op[j][b]) )
+                    if live[idx]:
+                        out.append( self.twobody_sample(k, aux[idx], self._sig_op[i][a], self._sig_op[j][b], balance) )
                     idx += 1
-        if self.include_prefactors:
+        if fixed and self.include_prefactors:
             prefactor = np.exp( 0.5 * np.sum(coupling.coefficients**2))
-            out.append(  HilbertOperator(self.n_particles, self.isospin).scale(prefactor) )
+            out.append( self._fixed_factor(self._ident.scale(prefactor), balance) )
+        return out
+
+
+class HilbertPropagatorHSEigen(HilbertPropagatorHS):
+    """ eigen-mode HS propagator in the full basis, see ProductPropagatorHSEigen
+    the factors are the product operators sampled by ProductPropagatorHSEigen; if matrix_free they act on HilbertStates
+    one particle at a time, otherwise they are converted to HilbertOperators
+    """
+    def __init__(self, n_particles, dt, isospin=True, include_prefactors=True, matrix_free=False, rank1_spinorbit=False):
+        super().__init__(n_particles, dt, isospin, include_prefactors, matrix_free, rank1_spinorbit)
+        self._product = ProductPropagatorHSEigen(n_particles, dt, isospin, include_prefactors)
+        self._product._live = self._live
+        self.n_aux_sigma = self._product.n_aux_sigma
+        self.n_aux_sigmatau = self._product.n_aux_sigmatau
+        self.n_aux_tau = self._product.n_aux_tau
+        self.n_aux_coulomb = self._product.n_aux_coulomb
+
+    def aux_strengths(self, channel: str, coupling: Coupling):
+        if channel=='spinorbit':
+            return super().aux_strengths(channel, coupling)
+        return self._product.aux_strengths(channel, coupling)
+
+    def prune(self, potential: ArgonnePotential, sigma=False, sigmatau=False, tau=False, coulomb=False, spinorbit=False, threshold=0.0):
+        out = super().prune(potential, sigma, sigmatau, tau, coulomb, spinorbit, threshold)
+        self._product._live = self._live
         return out
 
+    def _hilbert_factors(self, factors: list):
+        """the product factors (or pairs of factors) in the full basis"""
+        if self.matrix_free:
+            return factors
+        return [tuple(g.to_manybody_basis() for g in f) if isinstance(f, tuple) else f.to_manybody_basis() for f in factors]
+
+    def factors_sigma(self, coupling: Coupling, aux: list, balance=False):
+        return self._hilbert_factors(self._product.factors_sigma(coupling, aux, balance))
+
+    def factors_sigmatau(self, coupling: Coupling, aux: list, balance=False):
+        return self._hilbert_factors(self._product.factors_sigmatau(coupling, aux, balance))
+
+    def factors_tau(self, coupling: Coupling, aux: list, balance=False):
+        return self._hilbert_factors(self._product.factors_tau(coupling, aux, balance))
+
+    def factors_coulomb(self, coupling: Coupling, aux: list, fixed=True, balance=False):
+        return self._hilbert_factors(self._product.factors_coulomb(coupling, aux, fixed, balance))
 
 
 class HilbertPropagatorRBM(Propagator):
-    """ exp( - k op_i op_j )"""
-    def __init__(self, n_particles, dt, isospin=True, include_prefactors=True):
-        super().__init__(n_particles, dt, isospin, include_prefactors)
-        self._ident = HilbertOperator(self.n_particles, isospin=isospin)
-        self._sig_op = [[HilbertOperator(self.n_particles, isospin=isospin).apply_sigma(i,a) for a in [0, 1, 2]] for i in range(self.n_particles)]
-        self._tau_op = [[HilbertOperator(self.n_particles, isospin=isospin).apply_tau(i,a) for a in [0, 1, 2]] for i in range(self.n_particles)]
+    """ exp( - k op_i op_j )
+    with fixed couplings each twobody factor has only two possible values (h = 0, 1)
+    sampled factors are kept in an LRU cache of at most cache_bytes (per instance, so per worker), set cache_bytes=0 to
+    disable; the cache is not pickled, so with the plain process backend it starts empty for each chunk and is reused only
+    within that chunk, while on the serial and thread backends and in IntegratorSession workers it lasts across chunks
+    if matrix_free, the factors are LocalHilbertOperators and no 4^A x 4^A matrix is ever formed
+    rank1_spinorbit is not supported: a binary field gives cosh( O / sqrt(2) ) instead of exp( O^2 / 4 )
+    """
+    def __init__(self, n_particles, dt, isospin=True, include_prefactors=True, cache_bytes=2**26, matrix_free=False, rank1_spinorbit=False):
+        if rank1_spinorbit:
+            raise ValueError("rank1_spinorbit needs a Gaussian auxiliary field, use an HS propagator")
+        super().__init__(n_particles, dt, isospin, include_prefactors, rank1_spinorbit)
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()
+        self._cache_size = 0
+        self._cache_lock = threading.Lock()
+        self.matrix_free = matrix_free
+        if matrix_free:
+            self._ident = LocalHilbertOperator(self.n_particles, isospin=isospin)
+        else:
+            self._ident = operator_bank.get(self.n_particles, ('ident',), isospin)
+        self._sig_op = [[operator_bank.local(self.n_particles, ('sigma', i, a), isospin) for a in [0, 1, 2]] for i in range(self.n_particles)]
+        self._tau_op = [[operator_bank.local(self.n_particles, ('tau', i, a), isospin) for a in [0, 1, 2]] for i in range(self.n_particles)]
         self.n_aux_sigma = 9 * self._n2
         self.n_aux_sigmatau = 27 * self._n2
         self.n_aux_tau = 3 * self._n2
@@ -1087,87 +2065,175 @@ class HilbertPropagatorRBM(Propagator):
     def _a2b_factors(self, z):
         n = cexp(-abs(z))/2.
         w = carctanh(csqrt(ctanh(abs(z))))
-        s = z/abs(z)
+        s = np.sign(z)
         return n, w, s
 
+    def _skipped_factors(self, live, balance=False):
+        """a pruned pair factor is replaced by its value at z = 0, which is the normalization N(0) = 1/2"""
+        n_skipped = np.sum(~live)
+        if self.include_prefactors and n_skipped > 0:
+            return [self._fixed_factor(self._ident.scale(self._a2b_factors(0.)[0] ** n_skipped), balance)]
+        return []
+
     def onebody(self, z: complex, operator: HilbertOperator):
         """exp (- z opi)"""
         return operator.scale(-z).exp()
 
-    def twobody_sample(self, z: float, h: int, operator_i: HilbertOperator, operator_j: HilbertOperator):
+    def twobody_sample(self, z: float, h: int, operator_i: HilbertOperator, operator_j: HilbertOperator, balance=False):
+        """(c + s opi) (c - S s opj), built from its even and odd parts in 2h - 1, c^2 - S s^2 opi opj and c s (opi - S opj),
+        so that if balance the factor for 1 - h is returned too at the cost of one more sum"""
         N, W, S = self._a2b_factors(z)
         if self.include_prefactors:
             prefactor = N
         else:
             prefactor = 1.0
         arg = W*(2*h-1)
-        gi = self._ident.scale(ccosh(arg)) + operator_i.scale(csinh(arg))
-        gj = self._ident.scale(ccosh(arg)) - operator_j.scale(S * csinh(arg))
-        return gi.multiply_operator(gj).scale(prefactor)
+        c, s = ccosh(arg), csinh(arg)
+        even = self._ident.scale(prefactor * c * c) - operator_i.multiply_operator(operator_j).scale(prefactor * S * s * s)
+        odd = (operator_i - operator_j.scale(S)).scale(prefactor * c * s)
+        if balance:
+            return even + odd, even - odd
+        return even + odd
+
+    def __getstate__(self):
+        # the cache can be large, so it is not sent to worker processes
+        state = self.__dict__.copy()
+        state['_cache'] = OrderedDict()
+        state['_cache_size'] = 0
+        del state['_cache_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache_lock = threading.Lock()
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache = OrderedDict()
+            self._cache_size = 0
+
+    def twobody_sample_cached(self, label: tuple, z: float, h: int, operators, balance=False):
+        """twobody_sample(z, h, *operators(), balance) through the LRU cache
+        label identifies the pair of operators, operators is only called on a cache miss"""
+        keys = [(label, z, int(h)), (label, z, 1 - int(h))] if balance else [(label, z, int(h))]
+        with self._cache_lock:
+            if all(key in self._cache for key in keys):
+                for key in keys:
+                    self._cache.move_to_end(key)
+                out = [self._cache[key] for key in keys]
+                return tuple(out) if balance else out[0]
+        out = self.twobody_sample(z, h, *operators(), balance)
+        for key, factor in zip(keys, out if balance else [out]):
+            self._cache_put(key, factor)
+        return out
+
+    def _cache_put(self, key, factor):
+        nbytes = factor.coefficients.nbytes
+        with self._cache_lock:
+            if nbytes <= self.cache_bytes and key not in self._cache:
+                while self._cache_size + nbytes > self.cache_bytes:
+                    _, old = self._cache.popitem(last=False)
+                    self._cache_size -= old.coefficients.nbytes
+                self._cache[key] = factor
+                self._cache_size += nbytes
+
+    def build_tables(self, potential: ArgonnePotential, sigma=False, sigmatau=False, tau=False, coulomb=False, spinorbit=False):
+        """fills the cache with both outcomes of every twobody factor of the chosen channels, as far as cache_bytes allows"""
+        for channel, flag in zip(['sigma', 'sigmatau', 'tau', 'coulomb', 'spinorbit'], [sigma, sigmatau, tau, coulomb, spinorbit]):
+            if flag:
+                n_aux = getattr(self, f'n_aux_{channel}')
+                for h in [0, 1]:
+                    getattr(self, f'factors_{channel}')(getattr(potential, channel), np.full(n_aux, h))
+        return self
 
-    def factors_sigma(self, coupling: Coupling, aux: list):
+    def factors_sigma(self, coupling: Coupling, aux: list, balance=False):
+        """if balance, returns the pairs of factors for aux and for the flipped fields (see Integrator.bracket_balanced)"""
         out = []
         idx = 0
+        aux, live = self._expand_aux('sigma', coupling, aux)
         for i,j in self._2b_idx:
             for a in self._xyz:
                 for b in self._xyz:
                     k = 0.5 * self.dt * coupling[a,i,b,j]
-                    out.append( self.twobody_sample(k, aux[idx], self._sig_op[i][a], self._sig_op[j][b]) )
+                    operators = lambda: (self._sig_op[i][a], self._sig_op[j][b])
+                    if live[idx]:
+                        out.append( self.twobody_sample_cached(('sigma', i, j, a, b), k, aux[idx], operators, balance) )
                     idx += 1
+        out.extend( self._skipped_factors(live, balance) )
         return out
 
-    def factors_sigmatau(self, coupling: Coupling,  aux: list):
+    def factors_sigmatau(self, coupling: Coupling,  aux: list, balance=False):
         out = []
         idx = 0
+        aux, live = self._expand_aux('sigmatau', coupling, aux)
         for i,j in self._2b_idx:
             for a in self._xyz:
                 for b in self._xyz:
                     for c in self._xyz:
                         k = 0.5 * self.dt * coupling[a,i,b,j]
-                        opi = self._sig_op[i][a].multiply_operator(self._tau_op[i][c])
-                        opj = self._sig_op[j][b].multiply_operator(self._tau_op[j][c])
-                        out.append( self.twobody_sample(k, aux[idx], opi, opj) )
+                        operators = lambda: (self._sig_op[i][a].multiply_operator(self._tau_op[i][c]),
+                                             self._sig_op[j][b].multiply_operator(self._tau_op[j][c]))
+                        if live[idx]:
+                            out.append( self.twobody_sample_cached(('sigmatau', i, j, a, b, c), k, aux[idx], operators, balance) )
                         idx += 1
+        out.extend( self._skipped_factors(live, balance) )
         return out
     
-    def factors_tau(self, coupling: Coupling, aux: list):
+    def factors_tau(self, coupling: Coupling, aux: list, balance=False):
         out = []
         idx = 0
+        aux, live = self._expand_aux('tau', coupling, aux)
         for i,j in self._2b_idx:
             for a in self._xyz:
                     k = 0.5 * self.dt * coupling[i,j]
-                    out.append( self.twobody_sample(k, aux[idx], self._tau_op[i][a], self._tau_op[j][a]) )
+                    operators = lambda: (self._tau_op[i][a], self._tau_op[j][a])
+                    if live[idx]:
+                        out.append( self.twobody_sample_cached(('tau', i, j, a), k, aux[idx], operators, balance) )
+                    idx += 1
+        out.extend( self._skipped_factors(live, balance) )
         return out
 
-    def factors_coulomb(self, coupling: Coupling, aux: list):
+    def factors_coulomb(self, coupling: Coupling, aux: list, fixed=True, balance=False):
+        """if not fixed, the factors that do not depend on aux (see fixed_terms) are left out"""
         out = []
         idx = 0
+        aux, live = self._expand_aux('coulomb', coupling, aux)
         for i,j in self._2b_idx:
                 k = 0.125 * self.dt * coupling[i,j]
-                if self.include_prefactors:
-                    out.append(HilbertOperator(self.n_particles, self.isospin).scale(cexp(-k)))
-                out.append( self.onebody(k, self._tau_op[i][2]) )
-                out.append( self.onebody(k, self._tau_op[j][2]) )
-                out.append( self.twobody_sample(k, aux[idx], self._tau_op[i][2], self._tau_op[j][2]) )
+                if fixed and self.include_prefactors:
+                    out.append( self._fixed_factor(self._ident.scale(cexp(-k)), balance) )
+                if fixed:
+                    out.append( self._fixed_factor(self.onebody(k, self._tau_op[i][2]), balance) )
+                    out.append( self._fixed_factor(self.onebody(k, self._tau_op[j][2]), balance) )
+                operators = lambda: (self._tau_op[i][2], self._tau_op[j][2])
+                if live[idx]:
+                    out.append( self.twobody_sample_cached(('coulomb', i, j), k, aux[idx], operators, balance) )
                 idx += 1
+        out.extend( self._skipped_factors(live, balance) )
         return out
     
-    def factors_spinorbit(self, coupling: Coupling, aux: list):
+    def factors_spinorbit(self, coupling: Coupling, aux: list, fixed=True, balance=False):
+        """if not fixed, the factors that do not depend on aux (see fixed_terms) are left out"""
         out = []
         idx = 0
+        aux, live = self._expand_aux('spinorbit', coupling, aux)
         for i in self._1b_idx:
             for a in self._xyz:
                 k = 1.j * coupling[a,i]
-                out.append( self.onebody(k,  self._sig_op[i][a])  )
+                if fixed:
+                    out.append( self._fixed_factor(self.onebody(k,  self._sig_op[i][a]), balance) )
         for i,j in self._2b_idx:
             for a in self._xyz:
                 for b in self._xyz:
                     k = - 0.5 * coupling[a, i] * coupling[b, j] 
-                    out.append( self.twobody_sample(k, aux[idx], self._sig_op[i][a], self._sig_op[j][b]) )
+                    operators = lambda: (self._sig_op[i][a], self._sig_op[j][b])
+                    if live[idx]:
+                        out.append( self.twobody_sample_cached(('spinorbit', i, j, a, b), k, aux[idx], operators, balance) )
                     idx += 1
-        if self.include_prefactors:
+        if fixed and self.include_prefactors:
             prefactor = np.exp( 0.5 * np.sum(coupling.coefficients**2))
-            out.append( HilbertOperator(self.n_particles, self.isospin).scale(prefactor) )
+            out.append( self._fixed_factor(self._ident.scale(prefactor), balance) )
+        out.extend( self._skipped_factors(live, balance) )
         return out
 
 
@@ -1175,9 +2241,9 @@ class HilbertPropagatorRBM3(Propagator):
     """ exp( - z op_i op_j op_k )"""
     def __init__(self, n_particles, dt, isospin=True, include_prefactors=True):
         super().__init__(n_particles, dt, isospin, include_prefactors)
-        self._ident = HilbertOperator(self.n_particles, isospin=isospin)
-        self._sig_op = [[HilbertOperator(self.n_particles, isospin=isospin).apply_sigma(i,a) for a in [0, 1, 2]] for i in range(self.n_particles)]
-        self._tau_op = [[HilbertOperator(self.n_particles, isospin=isospin).apply_tau(i,a) for a in [0, 1, 2]] for i in range(self.n_particles)]
+        self._ident = operator_bank.get(self.n_particles, ('ident',), isospin)
+        self._sig_op = [[operator_bank.local(self.n_particles, ('sigma', i, a), isospin) for a in [0, 1, 2]] for i in range(self.n_particles)]
+        self._tau_op = [[operator_bank.local(self.n_particles, ('tau', i, a), isospin) for a in [0, 1, 2]] for i in range(self.n_particles)]
         self.n_aux_sigma = 9 * self._n3
 
     def _a2b_factors(self, z):
@@ -1267,218 +2333,435 @@ class HilbertPropagatorRBM3(Propagator):
 
 ## PRODUCT STATE PROPAGATORS
 
-class ProductPropagatorHS(Propagator):
-    """ exp( - k op_i op_j )"""
-    def __init__(self, n_particles: int, dt: float, isospin=True, include_prefactors=True):
-        super().__init__(n_particles, dt, isospin, include_prefactors)
-        
+class ProductPropagator(Propagator):
+    """ base class for the product state propagators
+
+    every factor acts on single particles, so the factors are described by a list of sample-independent terms:
+        ('onebody', k, i, op)              exp( - k op_i )
+        ('twobody', k, i, j, op_i, op_j)   sampled with one auxiliary field
+        ('table', i, j, table)             a twobody term with both outcomes precomputed, see ProductPropagatorRBM.build_tables
+        ('mode', k, ops, s)                exp( x sqrt(-k) sum_i ops_i ) with ops_i^2 = s_i^2, sampled with one auxiliary field, see ProductPropagatorHSEigen
+        ('scale', c)                       overall normalization
+        ('product', g)                     the fixed terms of a channel composed into one operator, g[i] acting on particle i
+    factors_*() samples the terms one at a time as LocalProductOperators, propagate_batch() applies them to many samples at once
+    subclasses define _twobody_coefficients(k, x), which returns (ci, si, cj, sj) such that a sampled twobody factor is
+    (ci + si op_i) * (cj + sj op_j), for a scalar x or an array of samples
+    """
+    def __init__(self, n_particles: int, dt: float, isospin=True, include_prefactors=True, rank1_spinorbit=False):
+        super().__init__(n_particles, dt, isospin, include_prefactors, rank1_spinorbit)
         if isospin:
             self._ident = np.identity(4)
             self._sig = [repeated_kronecker_product([np.identity(2), pauli(a)]) for a in [0, 1, 2]]
             self._tau = [repeated_kronecker_product([pauli(a), np.identity(2)]) for a in [0, 1, 2]]
+            self._sigtau = [[self._sig[a] @ self._tau[c] for c in [0, 1, 2]] for a in [0, 1, 2]]
         else:
             self._ident = np.identity(2)
             self._sig = pauli('list')
             self._tau = None
+            self._sigtau = None
         self.n_aux_sigma = 9 * self._n2
         self.n_aux_sigmatau = 27 * self._n2
         self.n_aux_tau = 3 * self._n2
         self.n_aux_coulomb = 1 * self._n2
-        self.n_aux_spinorbit = 9 * self._n2
+        self.n_aux_spinorbit = 1 if rank1_spinorbit else 9 * self._n2
+        self._tables = {}
 
     def onebody(self, k: complex, i: int, onebody_matrix: np.ndarray):
         """exp (- k opi) * |ket> """
-        out = ProductOperator(self.n_particles, self.isospin)
-        out.coefficients[i] = ccosh(k) * out.coefficients[i] - csinh(k) * onebody_matrix @ out.coefficients[i]
-        return out
-    
-    def twobody_sample(self, k: complex, x: float, i: int, j: int, onebody_matrix_i: np.ndarray, onebody_matrix_j: np.ndarray):
-        """exp ( sqrt( -kx ) opi opj) * |ket>  """
-        arg = csqrt(-k)*x
-        if self.include_prefactors:
-            prefactor = cexp(k)
-        else:
-            prefactor = 1.0
-        out = ProductOperator(self.n_particles, self.isospin)
-        out.coefficients[i] = ccosh(arg) * out.coefficients[i] + csinh(arg) * onebody_matrix_i @ out.coefficients[i]
-        out.coefficients[j] = ccosh(arg) * out.coefficients[j] + csinh(arg) * onebody_matrix_j @ out.coefficients[j]
-        out.coefficients[i] *= csqrt(prefactor)
-        out.coefficients[j] *= csqrt(prefactor)
-        return out
-
-    def factors_sigma(self, coupling: Coupling, aux: list):
+        g = ccosh(k) * self._ident - csinh(k) * onebody_matrix
+        return LocalProductOperator(self.n_particles, [i], g.reshape(1, *g.shape), self.isospin)
+
+    def twobody_sample(self, k: complex, x, i: int, j: int, onebody_matrix_i: np.ndarray, onebody_matrix_j: np.ndarray, balance=False):
+        """if balance, also returns the factor for the flipped field, which only changes the sign of the odd (sinh) parts"""
+        ci, si, cj, sj = self._twobody_coefficients(k, x)
+        even = np.stack([ci * self._ident, cj * self._ident])
+        odd = np.stack([si * onebody_matrix_i, sj * onebody_matrix_j])
+        if balance:
+            return (LocalProductOperator(self.n_particles, [i, j], even + odd, self.isospin),
+                    LocalProductOperator(self.n_particles, [i, j], even - odd, self.isospin))
+        return LocalProductOperator(self.n_particles, [i, j], even + odd, self.isospin)
+
+    def terms_sigma(self, coupling: Coupling):
         out = []
-        idx = 0
         for i,j in self._2b_idx:
             for a in self._xyz:
                 for b in self._xyz:
                     k = 0.5 * self.dt * coupling[a,i,b,j]
-                    out.append( self.twobody_sample(k, aux[idx], i, j, self._sig[a], self._sig[b]) )
-                    idx += 1
+                    out.append( ('twobody', k, i, j, self._sig[a], self._sig[b]) )
         return out
 
-    def factors_sigmatau(self, coupling: Coupling,  aux: list):
+    def terms_sigmatau(self, coupling: Coupling):
         out = []
-        idx = 0
         for i,j in self._2b_idx:
             for a in self._xyz:
                 for b in self._xyz:
                     for c in self._xyz:
                         k = 0.5 * self.dt * coupling[a,i,b,j]
-                        out.append( self.twobody_sample(k, aux[idx], i, j, self._sig[a] @ self._tau[c], self._sig[b] @ self._tau[c]) )
-                        idx += 1
+                        out.append( ('twobody', k, i, j, self._sigtau[a][c], self._sigtau[b][c]) )
         return out
-    
-    def factors_tau(self, coupling: Coupling, aux: list):
+
+    def terms_tau(self, coupling: Coupling):
         out = []
-        idx = 0
         for i,j in self._2b_idx:
             for a in self._xyz:
-                    k = 0.5 * self.dt * coupling[i,j]
-                    out.append( self.twobody_sample(k, aux[idx], i, j, self._tau[a], self._tau[a]) )
+                k = 0.5 * self.dt * coupling[i,j]
+                out.append( ('twobody', k, i, j, self._tau[a], self._tau[a]) )
         return out
 
-    def factors_coulomb(self, coupling: Coupling, aux: list):
+    def terms_coulomb(self, coupling: Coupling):
         out = []
-        idx = 0
         for i,j in self._2b_idx:
-                k = 0.125 * self.dt * coupling[i,j]
-                if self.include_prefactors:
-                    norm_op = ProductOperator(self.n_particles, self.isospin)
-                    norm_op = norm_op.scale_all(cexp(-k))
-                    out.append(norm_op)
-                out.append( self.onebody(k, i, self._tau[2]) )
-                out.append( self.onebody(k, j, self._tau[2]) )
-                out.append( self.twobody_sample(k, aux[idx], i, j, self._tau[2], self._tau[2]) )
-                idx += 1
+            k = 0.125 * self.dt * coupling[i,j]
+            if self.include_prefactors:
+                out.append( ('scale', cexp(-k)) )
+            out.append( ('onebody', k, i, self._tau[2]) )
+            out.append( ('onebody', k, j, self._tau[2]) )
+            out.append( ('twobody', k, i, j, self._tau[2], self._tau[2]) )
         return out
-    
-    def factors_spinorbit(self, coupling: Coupling, aux: list):
+
+    def terms_spinorbit(self, coupling: Coupling):
         out = []
-        idx = 0
         for i in self._1b_idx:
             for a in self._xyz:
                 k = 1.j * coupling[a,i]
-                out.append( self.onebody(k, i, self._sig[a])  )
+                out.append( ('onebody', k, i, self._sig[a]) )
+        if self.rank1_spinorbit:
+            term, prefactor = self.spinorbit_mode(coupling)
+            out.append( term )
+            if self.include_prefactors:
+                out.append( ('scale', prefactor) )
+            return out
         for i,j in self._2b_idx:
             for a in self._xyz:
                 for b in self._xyz:
-                    k = - 0.5 * coupling[a, i] * coupling[b, j] 
-                    out.append( self.twobody_sample(k, aux[idx], i, j, self._sig[a], self._sig[b]) )
-                    idx += 1
+                    k = - 0.5 * coupling[a, i] * coupling[b, j]
+                    out.append( ('twobody', k, i, j, self._sig[a], self._sig[b]) )
         if self.include_prefactors:
-            norm_op = ProductOperator(self.n_particles, self.isospin)
-            norm_op = norm_op.scale_all(np.exp( 0.5 * np.sum(coupling.coefficients**2)) )
-            out.append( norm_op )
-        return out    
-
+            out.append( ('scale', np.exp( 0.5 * np.sum(coupling.coefficients**2))) )
+        return out
 
-class ProductPropagatorRBM(Propagator):
-    """ exp( - k op_i op_j )
-    seed determines mixing
-    """
-    def __init__(self, n_particles, dt, isospin=True, include_prefactors=True):
-        super().__init__(n_particles, dt, isospin, include_prefactors)
-        if isospin:
-            self._ident = np.identity(4)
-            self._sig = [repeated_kronecker_product([np.identity(2), pauli(a)]) for a in [0, 1, 2]]
-            self._tau = [repeated_kronecker_product([pauli(a), np.identity(2)]) for a in [0, 1, 2]]
+    def aux_strengths(self, channel: str, coupling: Coupling):
+        """|k| for the pair terms, and for the mode terms |k| (sum_i s_i)^2 / 2, which bounds |k| O^2 / 2"""
+        out = []
+        for term in getattr(self, f'terms_{channel}')(coupling):
+            if term[0]=='twobody':
+                out.append( abs(term[1]) )
+            elif term[0]=='mode':
+                out.append( 0.5 * abs(term[1]) * np.sum(term[3])**2 )
+        return np.array(out)
+
+    def _table_key(self, channel: str, coupling: Coupling):
+        return (channel, coupling.coefficients.tobytes())
+
+    def channel_terms(self, channel: str, coupling: Coupling):
+        """terms for one channel, taken from the lookup tables if they were built for this coupling
+        and without the sampled terms that were pruned"""
+        key = self._table_key(channel, coupling)
+        if key in self._tables:
+            out = self._tables[key]
         else:
-            self._ident = np.identity(2)
-            self._sig = pauli('list')
-            self._tau = None
-        self.n_aux_sigma = 9 * self._n2
-        self.n_aux_sigmatau = 27 * self._n2
-        self.n_aux_tau = 3 * self._n2
-        self.n_aux_coulomb = 1 * self._n2
-        self.n_aux_spinorbit = 9 * self._n2
+            out = getattr(self, f'terms_{channel}')(coupling)
+        live = self.live_mask(channel, coupling)
+        if live is not None:
+            out = [term for term, col in zip(out, self._aux_columns(out)) if col is None or live[col]]
+        return out
 
-    def onebody(self, k: complex, i: int, onebody_matrix: np.ndarray):
-        """exp (- k opi) * |ket> """
-        out = ProductOperator(self.n_particles)
-        out.coefficients[i] = ccosh(k) * out.coefficients[i] - csinh(k) * onebody_matrix @ out.coefficients[i]
+    def terms(self, potential: ArgonnePotential, sigma=False, sigmatau=False, tau=False, coulomb=False, spinorbit=False, compose_fixed=False):
+        """all terms for the chosen channels, in the same order as the auxiliary fields in Integrator.setup
+        if compose_fixed, the fixed terms of the coulomb and spinorbit channels are replaced by one ('product', g) term at
+        the start of the channel, as Integrator.factors does without mixing"""
+        out = []
+        if sigma:
+            out.extend( self.channel_terms('sigma', potential.sigma) )
+        if sigmatau:
+            out.extend( self.channel_terms('sigmatau', potential.sigmatau) )
+        if tau:
+            out.extend( self.channel_terms('tau', potential.tau) )
+        for channel, flag in zip(['coulomb', 'spinorbit'], [coulomb, spinorbit]):
+            if flag and compose_fixed:
+                out.append( ('product', self.fixed_operator(channel, getattr(potential, channel)).coefficients) )
+                out.extend( self._sampled_terms(self.channel_terms(channel, getattr(potential, channel)), False) )
+            elif flag:
+                out.extend( self.channel_terms(channel, getattr(potential, channel)) )
+        return out
+
+    def sample_terms(self, terms: list, aux: list, balance=False):
+        """one factor per term, the twobody, table and mode terms consume aux in order
+        if balance, one pair of factors per term, for aux and for the flipped fields (see Integrator.bracket_balanced)"""
+        out = []
+        idx = 0
+        for term in terms:
+            if term[0]=='twobody':
+                _, k, i, j, opi, opj = term
+                out.append( self.twobody_sample(k, aux[idx], i, j, opi, opj, balance) )
+                idx += 1
+            elif term[0]=='table':
+                _, i, j, table = term
+                h = int(aux[idx])
+                g = LocalProductOperator(self.n_particles, [i, j], table[h], self.isospin)
+                out.append( (g, LocalProductOperator(self.n_particles, [i, j], table[1 - h], self.isospin)) if balance else g )
+                idx += 1
+            elif term[0]=='mode':
+                _, k, ops, s = term
+                out.append( self.mode_sample(k, aux[idx], ops, s, balance) )
+                idx += 1
+            elif term[0]=='onebody':
+                _, k, i, op = term
+                out.append( self._fixed_factor(self.onebody(k, i, op), balance) )
+            elif term[0]=='scale':
+                out.append( self._fixed_factor(LocalProductOperator(self.n_particles, isospin=self.isospin).scale_all(term[1]), balance) )
+            elif term[0]=='product':
+                g = ProductOperator(self.n_particles, self.isospin)
+                g.coefficients = np.array(term[1], dtype=complex)
+                out.append( self._fixed_factor(g, balance) )
         return out
-    
-    def twobody_sample(self, k: complex, h: int, i: int, j: int, onebody_matrix_i, onebody_matrix_j):
+
+    def factors_sigma(self, coupling: Coupling, aux: list, balance=False):
+        return self.sample_terms(self.channel_terms('sigma', coupling), aux, balance)
+
+    def factors_sigmatau(self, coupling: Coupling, aux: list, balance=False):
+        return self.sample_terms(self.channel_terms('sigmatau', coupling), aux, balance)
+
+    def factors_tau(self, coupling: Coupling, aux: list, balance=False):
+        return self.sample_terms(self.channel_terms('tau', coupling), aux, balance)
+
+    def factors_coulomb(self, coupling: Coupling, aux: list, fixed=True, balance=False):
+        return self.sample_terms(self._sampled_terms(self.channel_terms('coulomb', coupling), fixed), aux, balance)
+
+    def factors_spinorbit(self, coupling: Coupling, aux: list, fixed=True, balance=False):
+        return self.sample_terms(self._sampled_terms(self.channel_terms('spinorbit', coupling), fixed), aux, balance)
+
+    def _sampled_terms(self, terms: list, fixed: bool):
+        """the terms, without the onebody, scale and product ones if not fixed"""
+        if fixed:
+            return terms
+        return [term for term in terms if term[0] not in ['onebody', 'scale', 'product']]
+
+    def fixed_terms(self, channel: str, coupling: Coupling):
+        return [term for term in self.channel_terms(channel, coupling) if term[0] in ['onebody', 'scale']]
+
+    def _aux_columns(self, terms: list):
+        """column of the auxiliary field array used by each term (None if not sampled)"""
+        out = []
+        idx = 0
+        for term in terms:
+            if term[0] in ['twobody', 'table', 'mode']:
+                out.append(idx)
+                idx += 1
+            else:
+                out.append(None)
+        return out
+
+    def _apply_term_batch(self, term, coefficients: np.ndarray, x, antithetic=False):
+        """applies one term to a batch of kets of shape (n_samples, A, n_basis, 1), in place
+        if antithetic, the batch holds 2 * len(x) kets and the second half is propagated with the flipped fields;
+        flipping only changes the sign of the odd (sinh) parts, so the coefficients are computed once for both halves"""
+        even = lambda c: np.concatenate([c, c]) if antithetic else c
+        odd = lambda c: np.concatenate([c, -c]) if antithetic else c
+        if term[0]=='twobody':
+            _, k, i, j, opi, opj = term
+            ci, si, cj, sj = [np.reshape(c, (-1, 1, 1)) for c in self._twobody_coefficients(k, x)]
+            ci, si, cj, sj = even(ci), odd(si), even(cj), odd(sj)
+            coefficients[:, i] = ci * coefficients[:, i] + si * np.matmul(opi, coefficients[:, i])
+            coefficients[:, j] = cj * coefficients[:, j] + sj * np.matmul(opj, coefficients[:, j])
+        elif term[0]=='table':
+            _, i, j, table = term
+            h = np.asarray(x, dtype=int)
+            g = table[np.concatenate([h, 1 - h])] if antithetic else table[h]
+            coefficients[:, i] = np.matmul(g[:, 0], coefficients[:, i])
+            coefficients[:, j] = np.matmul(g[:, 1], coefficients[:, j])
+        elif term[0]=='mode':
+            _, k, ops, s = term
+            arg = np.reshape(csqrt(-k)*x, (-1, 1, 1))
+            for i in self._1b_idx:
+                if s[i]!=0:
+                    c, sh = even(ccosh(arg*s[i])), odd(csinh(arg*s[i]) / s[i])
+                    coefficients[:, i] = c * coefficients[:, i] + sh * np.matmul(ops[i], coefficients[:, i])
+        elif term[0]=='onebody':
+            _, k, i, op = term
+            g = ccosh(k) * self._ident - csinh(k) * op
+            coefficients[:, i] = np.matmul(g, coefficients[:, i])
+        elif term[0]=='scale':
+            coefficients *= term[1] ** (1 / self.n_particles)
+        elif term[0]=='product':
+            coefficients[:] = np.matmul(term[1], coefficients)
+        return coefficients
+
+    def propagate_batch(self, terms: list, coefficients: np.ndarray, aux_fields: np.ndarray, order=None, balance=False):
+        """applies the terms to a batch of product kets, one sample per row of aux_fields
+
+        coefficients: array of shape (n_samples, A, n_basis, 1)
+        aux_fields: array of shape (n_samples, n_aux); for binary fields this may be the packed bits (uint8, see pack_aux),
+            which are read one column at a time
+        order: optional integer array of shape (n_samples, n_terms) giving a per-sample ordering of the terms
+        balance: if True, also propagates with the flipped fields (-x for HS, 1-h for RBM) in the same pass, and
+            returns 2 * n_samples kets, the flipped ones last
+        """
+        cols = self._aux_columns(terms)
+        if aux_fields.dtype==np.uint8:
+            column = lambda rows, c: packed_column(aux_fields[rows], c)
+        else:
+            column = lambda rows, c: aux_fields[rows, c]
+        out = np.array(coefficients, dtype=complex)
+        if balance:
+            out = np.concatenate([out, out])
+        if order is None:
+            for term, col in zip(terms, cols):
+                x = None if col is None else column(slice(None), col)
+                self._apply_term_batch(term, out, x, balance)
+        else:
+            for step in range(order.shape[1]):
+                for t in np.unique(order[:, step]):
+                    mask = order[:, step]==t
+                    rows = np.concatenate([mask, mask]) if balance else mask
+                    x = None if cols[t] is None else column(mask, cols[t])
+                    out[rows] = self._apply_term_batch(terms[t], out[rows], x, balance)
+        return out
+
+
+class ProductPropagatorHS(ProductPropagator):
+    """ exp( - k op_i op_j )"""
+    def __init__(self, n_particles: int, dt: float, isospin=True, include_prefactors=True, rank1_spinorbit=False):
+        super().__init__(n_particles, dt, isospin, include_prefactors, rank1_spinorbit)
+
+    def _twobody_coefficients(self, k: complex, x):
+        """exp ( sqrt( -kx ) opi opj) * |ket>  """
+        arg = csqrt(-k)*x
         if self.include_prefactors:
-            prefactor = cexp(-abs(k))
+            prefactor = csqrt(cexp(k))
         else:
             prefactor = 1.0
-        W = carctanh(csqrt(ctanh(abs(k))))
-        arg = W*(2*h-1)
-        out = ProductOperator(self.n_particles, self.isospin)
-        out.coefficients[i] = ccosh(arg) * out.coefficients[i] + csinh(arg) * onebody_matrix_i @ out.coefficients[i]
-        out.coefficients[j] = ccosh(arg) * out.coefficients[j] - np.sign(k) * csinh(arg) * onebody_matrix_j @ out.coefficients[j]
-        out.coefficients[i] *= csqrt(prefactor)
-        out.coefficients[j] *= csqrt(prefactor)
-        return out
+        return prefactor * ccosh(arg), prefactor * csinh(arg), prefactor * ccosh(arg), prefactor * csinh(arg)
 
-    def factors_sigma(self, coupling: Coupling, aux: list):
+
+class ProductPropagatorHSEigen(ProductPropagatorHS):
+    """ HS propagator with one auxiliary field per eigenmode of the coupling matrix instead of one per pair
+
+    with S the symmetric coupling matrix over (a,i), S = sum_n lambda_n psi_n psi_n^T,
+        - 1/2 dt sum_{i<j} A_{ai,bj} op_ai op_bj = - 1/2 sum_n k_n O_n^2 ,   O_n = sum_ai psi_n(ai) op_ai ,   k_n = 1/2 dt lambda_n
+    each O_n is a sum of one-body operators that square to a number, so exp( x sqrt(-k_n) O_n ) is a product over particles
+    the sigma, sigmatau, tau and coulomb channels need 3A, 9A, 3A and A fields; spinorbit is sampled pairwise as before
+    the decompositions are computed once per coupling
+    """
+    def __init__(self, n_particles: int, dt: float, isospin=True, include_prefactors=True, rank1_spinorbit=False):
+        super().__init__(n_particles, dt, isospin, include_prefactors, rank1_spinorbit)
+        self.n_aux_sigma = 3 * self.n_particles
+        self.n_aux_sigmatau = 9 * self.n_particles
+        self.n_aux_tau = 3 * self.n_particles
+        self.n_aux_coulomb = 1 * self.n_particles
+        self._modes = {}
+
+    def eigenmodes(self, channel: str, coupling: Coupling):
+        """eigenvalues and eigenvectors (columns) of the symmetric matrix built from the i < j couplings
+        the eigenvectors are indexed by (a, i) for sigma and sigmatau, and by i for tau and coulomb"""
+        key = (channel, coupling.coefficients.tobytes())
+        if key not in self._modes:
+            n = self.n_particles
+            upper = np.triu(np.ones((n, n)), k=1)
+            if coupling.coefficients.ndim==4:
+                matrix = coupling.coefficients * upper[None, :, None, :]
+                matrix = (matrix + np.transpose(matrix, axes=(2, 3, 0, 1))).reshape(3*n, 3*n)
+            else:
+                matrix = coupling.coefficients * upper
+                matrix = matrix + matrix.T
+            eigenvalues, eigenvectors = np.linalg.eigh(matrix)
+            # round-off eigenvalues of a rank-deficient matrix are set to zero so that prune() can skip their modes
+            eigenvalues[np.abs(eigenvalues) <= len(eigenvalues) * np.finfo(float).eps * np.max(np.abs(eigenvalues), initial=0.)] = 0.
+            self._modes[key] = (eigenvalues, eigenvectors)
+        return self._modes[key]
+
+    def _mode_term(self, k: complex, ops: list):
+        """ops_i is a real combination of anticommuting involutions, so ops_i^2 = s_i^2 = tr(ops_i^2) / n_basis"""
+        ops = np.array(ops, dtype=complex)
+        s = np.sqrt(np.real(np.einsum('iab,iba->i', ops, ops)) / len(self._ident))
+        return ('mode', k, ops, s)
+
+    def terms_sigma(self, coupling: Coupling):
+        eigenvalues, eigenvectors = self.eigenmodes('sigma', coupling)
         out = []
-        idx = 0
-        for i,j in self._2b_idx:
-            for a in self._xyz:
-                for b in self._xyz:
-                    k = 0.5 * self.dt * coupling[a,i,b,j]
-                    out.append( self.twobody_sample(k, aux[idx], i, j, self._sig[a], self._sig[b]) )
-                    idx += 1
+        for n in range(3 * self.n_particles):
+            psi = eigenvectors[:, n].reshape(3, self.n_particles)
+            ops = [sum(psi[a, i] * self._sig[a] for a in self._xyz) for i in self._1b_idx]
+            out.append( self._mode_term(0.5 * self.dt * eigenvalues[n], ops) )
         return out
 
-    def factors_sigmatau(self, coupling: Coupling,  aux: list):
+    def terms_sigmatau(self, coupling: Coupling):
+        eigenvalues, eigenvectors = self.eigenmodes('sigmatau', coupling)
         out = []
-        idx = 0
-        for i,j in self._2b_idx:
-            for a in self._xyz:
-                for b in self._xyz:
-                    for c in self._xyz:
-                        k = 0.5 * self.dt * coupling[a,i,b,j]
-                        out.append( self.twobody_sample(k, aux[idx], i, j, self._sig[a] @ self._tau[c], self._sig[b] @ self._tau[c]) )
-                        idx += 1
+        for c in self._xyz:
+            for n in range(3 * self.n_particles):
+                psi = eigenvectors[:, n].reshape(3, self.n_particles)
+                ops = [sum(psi[a, i] * self._sigtau[a][c] for a in self._xyz) for i in self._1b_idx]
+                out.append( self._mode_term(0.5 * self.dt * eigenvalues[n], ops) )
         return out
-    
-    def factors_tau(self, coupling: Coupling, aux: list):
+
+    def terms_tau(self, coupling: Coupling):
+        eigenvalues, eigenvectors = self.eigenmodes('tau', coupling)
         out = []
-        idx = 0
-        for i,j in self._2b_idx:
-            for a in self._xyz:
-                    k = 0.5 * self.dt * coupling[i,j]
-                    out.append( self.twobody_sample(k, aux[idx], i, j, self._tau[a], self._tau[a]) )
+        for c in self._xyz:
+            for n in range(self.n_particles):
+                ops = [eigenvectors[i, n] * self._tau[c] for i in self._1b_idx]
+                out.append( self._mode_term(0.5 * self.dt * eigenvalues[n], ops) )
         return out
 
-    def factors_coulomb(self, coupling: Coupling, aux: list):
+    def terms_coulomb(self, coupling: Coupling):
         out = []
-        idx = 0
         for i,j in self._2b_idx:
-                k = 0.125 * self.dt * coupling[i,j]
-                if self.include_prefactors:
-                    norm_op = ProductOperator(self.n_particles)
-                    norm_op = norm_op.scale_all(cexp(-k))
-                    out.append(norm_op)
-                out.append( self.onebody(k, i, self._tau[2]) )
-                out.append( self.onebody(k, j, self._tau[2]) )
-                out.append( self.twobody_sample(k, aux[idx], i, j, self._tau[2], self._tau[2]) )
-                idx += 1
+            k = 0.125 * self.dt * coupling[i,j]
+            if self.include_prefactors:
+                out.append( ('scale', cexp(-k)) )
+            out.append( ('onebody', k, i, self._tau[2]) )
+            out.append( ('onebody', k, j, self._tau[2]) )
+        eigenvalues, eigenvectors = self.eigenmodes('coulomb', coupling)
+        for n in range(self.n_particles):
+            ops = [eigenvectors[i, n] * self._tau[2] for i in self._1b_idx]
+            out.append( self._mode_term(0.125 * self.dt * eigenvalues[n], ops) )
         return out
-    
-    
-    def factors_spinorbit(self, coupling: Coupling, aux: list):
-        out = []
-        idx = 0
-        for i in self._1b_idx:
-            for a in self._xyz:
-                k = 1.j * coupling[a,i]
-                out.append( self.onebody(k, i, self._sig[a])  )
-        for i,j in self._2b_idx:
-            for a in self._xyz:
-                for b in self._xyz:
-                    k = - 0.5 * coupling[a, i] * coupling[b, j] 
-                    out.append( self.twobody_sample(k, aux[idx], i, j, self._sig[a], self._sig[b]) )
-                    idx += 1
+
+
+class ProductPropagatorRBM(ProductPropagator):
+    """ exp( - k op_i op_j )
+    seed determines mixing
+    rank1_spinorbit is not supported: a binary field gives cosh( O / sqrt(2) ) instead of exp( O^2 / 4 )
+    """
+    def __init__(self, n_particles, dt, isospin=True, include_prefactors=True, rank1_spinorbit=False):
+        if rank1_spinorbit:
+            raise ValueError("rank1_spinorbit needs a Gaussian auxiliary field, use an HS propagator")
+        super().__init__(n_particles, dt, isospin, include_prefactors, rank1_spinorbit)
+
+    def _twobody_coefficients(self, k: complex, h):
         if self.include_prefactors:
-            norm_op = ProductOperator(self.n_particles)
-            norm_op = norm_op.scale_all(np.exp( 0.5 * np.sum(coupling.coefficients**2)) )
-            out.append( norm_op )
-        return out    
+            prefactor = csqrt(cexp(-abs(k)))
+        else:
+            prefactor = 1.0
+        W = carctanh(csqrt(ctanh(abs(k))))
+        arg = W*(2*h-1)
+        return prefactor * ccosh(arg), prefactor * csinh(arg), prefactor * ccosh(arg), - np.sign(k) * prefactor * csinh(arg)
+
+    def tabulate(self, terms: list):
+        """replaces each twobody term by a table of its single particle matrices for h = 0, 1
+        the table has shape (2, 2, n_basis, n_basis), indexed by [h, particle i or j]"""
+        out = []
+        h = np.array([0, 1])
+        for term in terms:
+            if term[0]=='twobody':
+                _, k, i, j, opi, opj = term
+                ci, si, cj, sj = [np.reshape(c, (2, 1, 1)) for c in self._twobody_coefficients(k, h)]
+                table = np.stack([ci * self._ident + si * opi, cj * self._ident + sj * opj], axis=1)
+                out.append( ('table', i, j, table) )
+            else:
+                out.append(term)
+        return out
+
+    def build_tables(self, potential: ArgonnePotential, sigma=False, sigmatau=False, tau=False, coulomb=False, spinorbit=False):
+        """precomputes both outcomes of every twobody factor for the chosen channels of this potential
+        factors_*() and terms() use the tables whenever they are called with the same couplings"""
+        self._tables = {}
+        for channel, flag in zip(['sigma', 'sigmatau', 'tau', 'coulomb', 'spinorbit'], [sigma, sigmatau, tau, coulomb, spinorbit]):
+            if flag:
+                coupling = getattr(potential, channel)
+                self._tables[self._table_key(channel, coupling)] = self.tabulate(getattr(self, f'terms_{channel}')(coupling))
+        return self
 
 
 class ProductPropagatorRBM3(Propagator):
@@ -1576,48 +2859,56 @@ class ExactGFMC:
     """the "exact" propagator calculation must be done in the complete many-body basis
     we use Pade approximants for matrix exponentials
     the LS term can be represented using a linear approximation or the factorization procedure described in Stefano's thesis
+    every factor acts on two (or three) particles, so it is exponentiated in the local 16 (64) dimensional space and returned
+    as a LocalHilbertOperator; applied to a ket as a local gate, no 4^A x 4^A matrix is formed
     """
     def __init__(self, n_particles, isospin=True):
         self.n_particles = n_particles
         self.isospin = isospin
-        self.ident = HilbertOperator(n_particles, self.isospin)
-        self.sig = [[HilbertOperator(n_particles, self.isospin).apply_sigma(i,a) for a in [0, 1, 2]] for i in range(n_particles)]
-        self.tau = [[HilbertOperator(n_particles, self.isospin).apply_tau(i,a) for a in [0, 1, 2]] for i in range(n_particles)]
+        self.sig = [[operator_bank.local(n_particles, ('sigma', i, a), self.isospin) for a in [0, 1, 2]] for i in range(n_particles)]
+        self.tau = [[operator_bank.local(n_particles, ('tau', i, a), self.isospin) for a in [0, 1, 2]] for i in range(n_particles)]
         
         self.linear_spinorbit = False # secret parameter to use the linear approximation of LS instead of the factorization
 
+    @property
+    def ident(self):
+        """the dense identity, only needed to build G itself"""
+        return operator_bank.get(self.n_particles, ('ident',), self.isospin)
+
+    def _local_zero(self, indices: list):
+        return LocalHilbertOperator(self.n_particles, indices, isospin=self.isospin).zero()
+
     def g_pade_sig(self, dt: float, asig: SigmaCoupling, i: int, j: int):
-        out = HilbertOperator(self.n_particles, self.isospin).zero()
+        out = self._local_zero([i, j])
         for a in range(3):
             for b in range(3):
-                out += self.sig[i][a].multiply_operator(self.sig[j][b]).scale(asig[a, i, b, j])
+                out += self.sig[j][b].apply_sigma(i, a).scale(asig[a, i, b, j])
         out = out.scale(-0.5 * dt)
         return out.exp()
 
 
     def g_pade_sigtau(self, dt: float, asigtau: SigmaTauCoupling, i: int, j: int):
-        out = HilbertOperator(self.n_particles, self.isospin).zero()
+        out = self._local_zero([i, j])
         for a in range(3):
             for b in range(3):
                 for c in range(3):
-                    op = HilbertOperator(self.n_particles, self.isospin)
-                    op = op.multiply_operator(self.sig[i][a]).multiply_operator(self.tau[i][c])
-                    op = op.multiply_operator(self.sig[j][b]).multiply_operator(self.tau[j][c])
+                    op = self.sig[j][b].apply_tau(j, c).apply_sigma(i, a).apply_tau(i, c)
                     out += op.scale(asigtau[a, i, b, j])
         out = out.scale(-0.5 * dt)
         return out.exp()
 
 
     def g_pade_tau(self, dt, atau, i, j):
-        out = HilbertOperator(self.n_particles, self.isospin).zero()
+        out = self._local_zero([i, j])
         for c in range(3):
-            out += self.tau[i][c].multiply_operator(self.tau[j][c]).scale(atau[i, j])
+            out += self.tau[j][c].apply_tau(i, c).scale(atau[i, j])
         out = out.scale(-0.5 * dt)
         return out.exp()
 
 
     def g_pade_coul(self, dt, v, i, j):
-        out = self.ident + self.tau[i][2] + self.tau[j][2] + self.tau[i][2].multiply_operator(self.tau[j][2])
+        one = LocalHilbertOperator(self.n_particles, [i, j], isospin=self.isospin)
+        out = one + self.tau[i][2] + self.tau[j][2] + self.tau[j][2].apply_tau(i, 2)
         out = out.scale(-0.125 * v[i, j] * dt)
         return out.exp()
 
@@ -1631,9 +2922,10 @@ class ExactGFMC:
 
     def g_ls_linear(self, gls, i):
         # linear approx to LS
-        out = HilbertOperator(self.n_particles)
+        out = LocalHilbertOperator(self.n_particles, [i], isospin=self.isospin)
         for a in range(3):
-            out = (self.ident - self.sig[i][a].scale(1.j * gls[a, i])).multiply_operator(out) 
+            one = LocalHilbertOperator(self.n_particles, [i], isospin=self.isospin)
+            out = (one - self.sig[i][a].scale(1.j * gls[a, i])).multiply_operator(out) 
         return out
     
 
@@ -1645,61 +2937,476 @@ class ExactGFMC:
 
     def g_ls_twobody(self, gls, i, j, a, b):
         # two-body part of the LS propagator factorization
-        out = self.sig[i][a].multiply_operator(self.sig[j][b]).scale(0.5 * gls[a,i] * gls[b,j])
+        out = self.sig[j][b].apply_sigma(i, a).scale(0.5 * gls[a,i] * gls[b,j])
         return out.exp()
 
 
     def g_pade_sig_3b(self, dt, asig3b, i, j, k):
         # 3-body sigma
-        out = HilbertOperator(self.n_particles).zero()
+        out = self._local_zero([i, j, k])
         for a in range(3):
             for b in range(3):
                 for c in range(3):
-                    out += self.sig[i][a].multiply_operator(self.sig[j][b]).multiply_operator(self.sig[k][c]).scale(asig3b[a, i, b, j, c, k])
+                    out += self.sig[k][c].apply_sigma(j, b).apply_sigma(i, a).scale(asig3b[a, i, b, j, c, k])
         out = out.scale(-0.5 * dt)
         return out.exp()
 
-
-    def make_g_exact(self, dt, potential,
-                     sigma,
-                     sigmatau,
-                     tau,
-                     coulomb,
-                     spinorbit):
-        # compute exact bracket
-        g_exact = self.ident.copy()
+    def g_exact_factors(self, dt, potential,
+                        sigma,
+                        sigmatau,
+                        tau,
+                        coulomb,
+                        spinorbit):
+        """the local factors of the exact propagator, in the order they act"""
+        out = []
         pairs_ij = interaction_indices(self.n_particles)
         for i,j in pairs_ij:
             if sigma:
-                g_exact = self.g_pade_sig(dt, potential.sigma, i, j).multiply_operator(g_exact)
+                out.append(self.g_pade_sig(dt, potential.sigma, i, j))
             if sigmatau:
-                g_exact = self.g_pade_sigtau(dt, potential.sigmatau, i, j).multiply_operator(g_exact)
+                out.append(self.g_pade_sigtau(dt, potential.sigmatau, i, j))
             if tau:
-                g_exact = self.g_pade_tau(dt, potential.tau, i, j).multiply_operator(g_exact)
+                out.append(self.g_pade_tau(dt, potential.tau, i, j))
             if coulomb:
-                g_exact = self.g_pade_coul(dt, potential.coulomb, i, j).multiply_operator(g_exact)
+                out.append(self.g_pade_coul(dt, potential.coulomb, i, j))
         if spinorbit:
             if self.linear_spinorbit:
                 for i in range(self.n_particles):
-                    g_exact = self.g_ls_linear(potential.spinorbit, i) * g_exact
+                    out.append(self.g_ls_linear(potential.spinorbit, i))
             else:
                 for i in range(self.n_particles):
                     for a in range(3):
-                        g_exact = self.g_ls_onebody(potential.spinorbit, i, a).multiply_operator(g_exact)
+                        out.append(self.g_ls_onebody(potential.spinorbit, i, a))
                 for i in range(self.n_particles):
                     for j in range(self.n_particles):
                         for a in range(3):
                             for b in range(3):
-                                g_exact = self.g_ls_twobody(potential.spinorbit, i, j, a, b).multiply_operator(g_exact)
+                                out.append(self.g_ls_twobody(potential.spinorbit, i, j, a, b))
+        return out
+
+    def apply_g_exact(self, ket: HilbertState, dt, potential,
+                      sigma,
+                      sigmatau,
+                      tau,
+                      coulomb,
+                      spinorbit):
+        """G |ket>, applying the local factors as gates; this is O(4^A) per factor and works where G would not fit"""
+        ket_prop = ket.copy()
+        for g in self.g_exact_factors(dt, potential, sigma, sigmatau, tau, coulomb, spinorbit):
+            ket_prop = g.multiply_state(ket_prop)
+        return ket_prop
+
+    def make_g_exact(self, dt, potential,
+                     sigma,
+                     sigmatau,
+                     tau,
+                     coulomb,
+                     spinorbit):
+        # compute exact propagator, as a dense operator
+        g_exact = self.ident.copy()
+        for g in self.g_exact_factors(dt, potential, sigma, sigmatau, tau, coulomb, spinorbit):
+            g_exact = g.multiply_operator(g_exact)
         return g_exact
     
 
 
+class ExactCache(_DiskTier):
+    """memoized exact propagators G and brackets <bra|G|ket>, keyed by content fingerprints
+
+    a propagator is keyed by A, isospin, dt, the channel flags and the couplings of the chosen channels; a bracket also by the
+    bra and ket coefficients. propagators are kept in memory up to memory_bytes (least recently used dropped first), brackets
+    always. if a directory is set (or the SPINBOX_EXACT_DIR environment variable), both are also written there and read
+    back by later processes
+    """
+    environment = 'SPINBOX_EXACT_DIR'
+
+    def __init__(self, memory_bytes=2**30, directory=None):
+        super().__init__(directory)
+        self.memory_bytes = memory_bytes
+        self._propagators = OrderedDict()
+        self._propagators_size = 0
+        self._brackets = {}
+        self._lock = threading.RLock()
+
+    def clear(self):
+        """empties the memory tier; files on disk are kept"""
+        with self._lock:
+            self._propagators = OrderedDict()
+            self._propagators_size = 0
+            self._brackets = {}
+
+    def propagator_key(self, n_particles, isospin, dt, potential: ArgonnePotential, sigma, sigmatau, tau, coulomb, spinorbit,
+                       linear_spinorbit=False):
+        flags = (sigma, sigmatau, tau, coulomb, spinorbit)
+        couplings = [getattr(potential, channel).coefficients.tobytes()
+                     for channel, flag in zip(['sigma', 'sigmatau', 'tau', 'coulomb', 'spinorbit'], flags) if flag]
+        content = (n_particles, isospin, float(dt), flags, linear_spinorbit, couplings)
+        return hashlib.sha1(pickle.dumps(content)).hexdigest()
+
+    def bracket_key(self, propagator_key, bra: HilbertState, ket: HilbertState):
+        content = (propagator_key, bra.coefficients.tobytes(), ket.coefficients.tobytes())
+        return hashlib.sha1(pickle.dumps(content)).hexdigest()
+
+    def _load(self, name):
+        if self.directory is None:
+            return None
+        filename = os.path.join(self.directory, f"{name}.npy")
+        if os.path.exists(filename):
+            return np.load(filename)
+        return None
+
+    def _save(self, name, array):
+        if self.directory is not None:
+            self._write(os.path.join(self.directory, f"{name}.npy"), array)
+
+    def propagator(self, key, n_particles, isospin, build):
+        """the cached G for key, made by build() (a function returning a HilbertOperator) on a miss; the coefficients
+        are read-only"""
+        with self._lock:
+            if key in self._propagators:
+                self._propagators.move_to_end(key)
+                coefficients = self._propagators[key]
+            else:
+                coefficients = self._load(f"G_{key}")
+                if coefficients is None:
+                    coefficients = build().coefficients
+                    self._save(f"G_{key}", coefficients)
+                coefficients.flags.writeable = False
+                if coefficients.nbytes <= self.memory_bytes:
+                    while self._propagators_size + coefficients.nbytes > self.memory_bytes:
+                        _, old = self._propagators.popitem(last=False)
+                        self._propagators_size -= old.nbytes
+                    self._propagators[key] = coefficients
+                    self._propagators_size += coefficients.nbytes
+        return HilbertOperator(n_particles, isospin=isospin, coefficients=coefficients)
+
+    def bracket(self, key, compute):
+        """the cached bracket for key, made by compute() on a miss"""
+        with self._lock:
+            if key not in self._brackets:
+                out = self._load(f"bracket_{key}")
+                if out is None:
+                    out = np.asarray(compute())
+                    self._save(f"bracket_{key}", out)
+                self._brackets[key] = out
+            return self._brackets[key].copy()
+
+
+exact_cache = ExactCache()
+
+
+
+def _combine_moments(a, b):
+    """Chan et al. merge of (count, mean, m2) where the real and imaginary parts of m2 are the sums of squared deviations
+    of the real and imaginary parts"""
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    if n_a==0 or n_b==0:
+        return b if n_a==0 else a
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / n
+    m2 = m2_a + m2_b + (delta.real**2 + 1j * delta.imag**2) * n_a * n_b / n
+    return n, mean, m2
+
+def _moments(x):
+    """(count, mean, m2) of an array of complex values"""
+    if len(x)==0:
+        return 0, 0j, 0j
+    mean = np.mean(x)
+    return len(x), mean, np.sum((x.real - mean.real)**2) + 1j * np.sum((x.imag - mean.imag)**2)
+
+
+class RunningStatistics:
+    """mergeable streaming statistics of complex brackets, so that runs need not keep every sample
+
+    keeps Welford / Chan moments of the real and imaginary parts, the average phase b/|b|, and a blocking analysis: at level l
+    the samples are grouped into blocks of 2^l consecutive samples, by their global sample index, and the moments of the
+    block means are kept. partial blocks at the edges of a range are held until the neighbouring range is merged in, so
+    chunks evaluated anywhere give the same blocks as one long run
+    values must arrive in order of sample index: add() continues the range, and a.merge(b) needs b to start where a stops
+    if keep_samples, the raw values are kept too (in self.samples)
+    """
+    n_levels = 40
+    min_blocks = 32
+
+    def __init__(self, start=0, keep_samples=False):
+        self.start = start
+        self.stop = start
+        self.moments = [(0, 0j, 0j) for _ in range(self.n_levels)]
+        self.phase_moments = (0, 0j, 0j)
+        self._partial = [{} for _ in range(self.n_levels)]
+        self.keep_samples = keep_samples
+        self.samples = np.zeros(0, dtype=complex) if keep_samples else None
+
+    def _complete(self, level, blocks: dict):
+        """folds partial blocks {index: (count, sum)} into level, moving the blocks that are now full into the moments"""
+        size = 2**level
+        full = []
+        for index, (count, total) in blocks.items():
+            if index in self._partial[level]:
+                c, t = self._partial[level].pop(index)
+                count, total = count + c, total + t
+            if count==size:
+                full.append(total / size)
+            else:
+                self._partial[level][index] = (count, total)
+        self.moments[level] = _combine_moments(self.moments[level], _moments(np.array(full, dtype=complex)))
+
+    def add(self, values, start=None):
+        """adds the brackets of the samples start, start + 1, ... (start defaults to the end of the range so far)"""
+        values = np.asarray(values, dtype=complex).flatten()
+        start = self.stop if start is None else start
+        if self.stop==self.start:
+            self.start = self.stop = start
+        if start!=self.stop:
+            raise ValueError(f"Samples must be added in order: expected index {self.stop}, got {start}.")
+        stop = start + len(values)
+        if len(values)==0:
+            return self
+        self.moments[0] = _combine_moments(self.moments[0], _moments(values))
+        magnitude = np.abs(values)
+        phase = np.divide(values, magnitude, out=np.zeros_like(values), where=magnitude > 0)
+        self.phase_moments = _combine_moments(self.phase_moments, _moments(phase))
+        for level in range(1, self.n_levels):
+            size = 2**level
+            first, last = start // size, (stop - 1) // size
+            # the whole blocks strictly inside the range go straight into the moments
+            lo, hi = min(last, first + 1) * size, last * size
+            if first < last - 1:
+                means = values[lo - start : hi - start].reshape(-1, size).mean(axis=1)
+                self.moments[level] = _combine_moments(self.moments[level], _moments(means))
+            edges = {}
+            for index in sorted({first, last}):
+                a, b = max(start, index * size), min(stop, (index + 1) * size)
+                edges[index] = (b - a, np.sum(values[a - start : b - start]))
+            self._complete(level, edges)
+        self.stop = stop
+        if self.keep_samples:
+            self.samples = np.concatenate([self.samples, values])
+        return self
+
+    def merge(self, other):
+        """adds the statistics of the range that follows this one"""
+        if other.stop==other.start:
+            return self
+        if self.stop==self.start:
+            self.start = self.stop = other.start
+        if other.start!=self.stop:
+            raise ValueError(f"Can only merge the adjacent range starting at {self.stop}, got {other.start}.")
+        self.moments[0] = _combine_moments(self.moments[0], other.moments[0])
+        self.phase_moments = _combine_moments(self.phase_moments, other.phase_moments)
+        for level in range(1, self.n_levels):
+            self.moments[level] = _combine_moments(self.moments[level], other.moments[level])
+            self._complete(level, other._partial[level])
+        self.stop = other.stop
+        if self.keep_samples:
+            self.samples = np.concatenate([self.samples, other.samples])
+        return self
+
+    @property
+    def n(self):
+        return self.moments[0][0]
+
+    @property
+    def mean(self):
+        return self.moments[0][1]
+
+    @property
+    def variance(self):
+        """variances of the real and imaginary parts, as the real and imaginary parts of a complex number"""
+        return self.moments[0][2] / max(self.n, 1)
+
+    @property
+    def std(self):
+        """as np.std of the samples"""
+        return np.sqrt(self.variance.real + self.variance.imag)
+
+    @property
+    def phase(self):
+        """the average phase b/|b| (the average sign for real brackets)"""
+        return self.phase_moments[1]
+
+    def blocking_errors(self):
+        """standard error of the mean from the block means at each level with at least two blocks"""
+        out = []
+        for n, _, m2 in self.moments:
+            if n < 2:
+                break
+            out.append(np.sqrt((m2.real + m2.imag) / (n * (n - 1))))
+        return np.array(out)
+
+    @property
+    def error(self):
+        """the blocking estimate of the standard error: the largest over the levels with at least min_blocks blocks"""
+        errors = self.blocking_errors()
+        counts = np.array([m[0] for m in self.moments[:len(errors)]])
+        errors = errors[counts >= self.min_blocks]
+        if len(errors)==0:
+            return self.std / np.sqrt(max(self.n, 1))
+        return np.max(errors)
+
+    @property
+    def ess(self):
+        """effective sample size, the number of independent samples giving the same error"""
+        if self.error==0:
+            return float(self.n)
+        return min(float(self.n), self.std**2 / self.error**2)
+
+
+def _star(task):
+    """function(*args) for a (function, args) task, for the imap of a pool"""
+    function, args = task
+    return function(*args)
+
+def _write_checkpoint(filename, state):
+    """pickles state to filename atomically: a temporary file is written, synced and renamed over the old checkpoint"""
+    temp = f"{filename}.{os.getpid()}.tmp"
+    with open(temp, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, filename)
+
+
+_BLAS_ENVIRONMENT = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']
+
+@contextmanager
+def limit_blas_threads(n_threads):
+    """caps the BLAS threads of this process inside the block; does nothing if n_threads is None or threadpoolctl is missing"""
+    if n_threads is None or threadpool_limits is None:
+        yield
+    else:
+        with threadpool_limits(limits=n_threads):
+            yield
+
+def _check_blas_threads(n_threads):
+    """warns if a BLAS thread cap was asked for but cannot be enforced: without threadpoolctl, forked workers have BLAS
+    loaded already and ignore the environment"""
+    if n_threads is not None and threadpool_limits is None:
+        warnings.warn("blas_threads needs threadpoolctl (pip install spinbox[parallel]) and is ignored without it.", RuntimeWarning, stacklevel=3)
+
+def _init_blas(n_threads):
+    """pool initializer capping the BLAS threads of a worker process for its whole life
+    without threadpoolctl only the environment is set, which reaches BLAS libraries loaded after it (spawned workers)"""
+    if n_threads is None:
+        return
+    for name in _BLAS_ENVIRONMENT:
+        os.environ[name] = str(n_threads)
+    if threadpool_limits is not None:
+        threadpool_limits(limits=n_threads)
+
+
+# objects loaded by a pool worker of an IntegratorSession, by fingerprint; they stay warm across runs
+_worker_cache = OrderedDict()
+_WORKER_CACHE_SIZE = 32
+
+def _fetch(handle):
+    """the object published by IntegratorSession.publish, unpickled at most once per worker"""
+    fingerprint, name, size = handle
+    if fingerprint in _worker_cache:
+        _worker_cache.move_to_end(fingerprint)
+        return _worker_cache[fingerprint]
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        out = pickle.loads(bytes(shm.buf[:size]))
+    finally:
+        shm.close()
+    _worker_cache[fingerprint] = out
+    while len(_worker_cache) > _WORKER_CACHE_SIZE:
+        _worker_cache.popitem(last=False)
+    return out
+
+def _evaluate_range(handles, start, stop, balance, statistics=False, keep_samples=False):
+    """brackets for the samples start:stop, or their RunningStatistics, see Integrator.run_shared"""
+    integrator_handle, propagator_handle, potential_handle, bra_handle, ket_handle = handles
+    integrator = _fetch(integrator_handle)
+    integrator.propagator = _fetch(propagator_handle)
+    integrator.potential = _fetch(potential_handle)
+    if statistics:
+        return integrator.evaluate_statistics(_fetch(bra_handle), _fetch(ket_handle), start, stop, balance, keep_samples)
+    return integrator.evaluate(_fetch(bra_handle), _fetch(ket_handle), start, stop, balance)
+
+
+class IntegratorSession:
+    """a process pool kept alive across Integrator runs
+
+        with IntegratorSession(n_processes=4) as session:
+            integ.setup(..., session=session)
+            b = integ.run(bra, ket)
+
+    the workers run with blas_threads BLAS threads each (None for the library default), which needs threadpoolctl
+
+    objects are published into shared memory under the fingerprint of their pickle for as long as a run uses them (one
+    segment per distinct content, with a count of the runs using it), and every worker keeps the objects it has loaded
+    (up to _WORKER_CACHE_SIZE of them), so successive setup / run cycles with the same propagator and potential reuse the warm worker state
+    (e.g. the factor cache of HilbertPropagatorRBM) instead of unpickling them again
+    """
+    def __init__(self, n_processes=None, blas_threads=1):
+        self.n_processes = n_processes or os.cpu_count()
+        self.blas_threads = blas_threads
+        _check_blas_threads(blas_threads)
+        self.pool = None
+        self._published = {}
+        self._references = {}
+
+    def open(self):
+        if self.pool is None:
+            # workers must share the parent's resource tracker, or each one unlinks the segments it attached to on exit
+            resource_tracker.ensure_running()
+            self.pool = Pool(processes=self.n_processes, initializer=_init_blas, initargs=(self.blas_threads,))
+        return self
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        for shm in self._published.values():
+            shm.close()
+            shm.unlink()
+        self._published = {}
+        self._references = {}
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        raise TypeError("An IntegratorSession cannot be pickled.")
+
+    def publish(self, obj):
+        """places the pickle of obj in shared memory (once per distinct content) and returns a handle for _fetch, to be
+        given back to release when the run is done"""
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        fingerprint = hashlib.sha1(data).hexdigest()
+        if fingerprint not in self._published:
+            shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+            shm.buf[:len(data)] = data
+            self._published[fingerprint] = shm
+        self._references[fingerprint] = self._references.get(fingerprint, 0) + 1
+        return (fingerprint, self._published[fingerprint].name, len(data))
+
+    def release(self, handle):
+        """frees a published object once no run uses it any more (workers that loaded it keep their copy)"""
+        fingerprint = handle[0]
+        if fingerprint not in self._published:
+            return
+        self._references[fingerprint] -= 1
+        if self._references[fingerprint] == 0:
+            del self._references[fingerprint]
+            shm = self._published.pop(fingerprint)
+            shm.close()
+            shm.unlink()
+
+
 class Integrator:
     def __init__(self, potential: ArgonnePotential, propagator, isospin=True):
-        if type(propagator) in [HilbertPropagatorHS, ProductPropagatorHS]:
+        if isinstance(propagator, (HilbertPropagatorHS, ProductPropagatorHS)):
             self.method = 'HS'
-        elif type(propagator) in [HilbertPropagatorRBM, ProductPropagatorRBM]:
+        elif isinstance(propagator, (HilbertPropagatorRBM, ProductPropagatorRBM)):
             self.method = 'RBM'
         self.n_particles = potential.n_particles
         self.potential = potential
@@ -1718,19 +3425,57 @@ class Integrator:
               coulomb=False, 
               spinorbit=False,
               parallel=True,
-              n_processes=None):
-        
-        n_aux = 0
-        if sigma:
-            n_aux += self.propagator.n_aux_sigma
-        if sigmatau:
-            n_aux += self.propagator.n_aux_sigmatau
-        if tau:
-            n_aux += self.propagator.n_aux_tau
-        if coulomb:
-            n_aux += self.propagator.n_aux_coulomb
-        if spinorbit:
-            n_aux += self.propagator.n_aux_spinorbit
+              n_processes=None,
+              batched=False,
+              batch_size=10000,
+              tables=False,
+              prune=False,
+              threshold=0.0,
+              shared=False,
+              chunk_size=None,
+              session=None,
+              backend=None,
+              blas_threads=None):
+        """if prune, factors whose couplings are at most threshold are skipped (see Propagator.prune, the error bound is
+        kept in self.prune_error) and only the live auxiliary fields are used; self.aux_index maps them to the full layout
+        the auxiliary fields are not stored: inside whichever worker evaluates sample s, each of its live fields is computed
+        from the key of s and the field's column in the full layout alone (see draw), and its factor ordering if mix is
+        drawn from its own stream spawned from SeedSequence(seed) with key s (see sample_rng), so the brackets do not
+        depend on the chunk size, the number of workers or the backend, and a pruned run sees the same fields as the
+        unpruned one without generating the pruned ones
+        batched (product propagators only) propagates all samples of a chunk at once; with mix=False it gives the same
+        brackets as the per-sample path, but with mix=True the ordering is a permutation of the term list (batched) or of
+        the factor list (per sample), which differ in length and order, and pruning changes both lists, so mixed results
+        depend on batched and prune (each is still a valid sample of the same average)
+        if shared (with the process backend), run() uses run_shared, with chunks of chunk_size samples (None to choose automatically)
+        if a session (IntegratorSession) is given, run() always uses run_shared on its long-lived pool
+        backend is where the chunks of samples are evaluated: 'serial', 'thread' (a ThreadPool, which suits Hilbert basis
+        runs whose matrix products release the GIL) or 'process' (a Pool); None means 'process' if parallel else 'serial'
+        blas_threads caps the BLAS threads of every worker (needs threadpoolctl in-process); None means 1 for the thread and
+        process backends, to avoid oversubscription, and the library default for the serial backend"""
+        if backend is None:
+            backend = 'process' if parallel else 'serial'
+        if backend not in ['serial', 'thread', 'process']:
+            raise ValueError(f'No option: {backend}')
+        if prune:
+            self.prune_error = self.propagator.prune(self.potential, sigma, sigmatau, tau, coulomb, spinorbit, threshold)
+        else:
+            self.prune_error = self.propagator.prune(self.potential)
+
+        self.n_aux = {}
+        columns = []
+        n_aux_full = 0
+        for channel, flag in zip(['sigma', 'sigmatau', 'tau', 'coulomb', 'spinorbit'], [sigma, sigmatau, tau, coulomb, spinorbit]):
+            if flag:
+                n = getattr(self.propagator, f'n_aux_{channel}')
+                live = self.propagator.live_mask(channel, getattr(self.potential, channel))
+                if live is None:
+                    live = np.ones(n, dtype=bool)
+                columns.append(n_aux_full + np.flatnonzero(live))
+                self.n_aux[channel] = len(columns[-1])
+                n_aux_full += n
+        self.aux_index = np.concatenate(columns) if columns else np.zeros(0, dtype=int)
+        self.n_aux_full = n_aux_full
 
         self.sigma = sigma
         self.sigmatau = sigmatau
@@ -1740,63 +3485,404 @@ class Integrator:
         self.mix = mix
         self.parallel = parallel
         self.n_processes = n_processes
+        self.batched = batched
+        self.batch_size = batch_size
+        self.shared = shared
+        self.chunk_size = chunk_size
+        self.session = session
+        self.backend = backend
+        self.blas_threads = blas_threads
+        _check_blas_threads(blas_threads)
+        if tables:
+            if not isinstance(self.propagator, (ProductPropagatorRBM, HilbertPropagatorRBM)):
+                raise ValueError("Lookup tables are only available for RBM propagators.")
+            self.propagator.build_tables(self.potential, sigma, sigmatau, tau, coulomb, spinorbit)
+        if batched:
+            if not isinstance(self.propagator, ProductPropagator):
+                raise ValueError("Batched propagation requires a product state propagator.")
+            self.terms = self.propagator.terms(self.potential, sigma, sigmatau, tau, coulomb, spinorbit, compose_fixed=not mix)
+
+        # the factors that do not depend on the auxiliary fields are built once; without mixing each channel's fixed
+        # factors are composed into a single operator applied at the start of the channel, which is where the spin-orbit
+        # ones already are, so their position relative to the sampled factors is preserved (they do not commute with them);
+        # the Coulomb ones move only past sampled factors that are functions of the same tau_z operators; batched terms are
+        # composed the same way (compose_fixed in ProductPropagator.terms)
+        self.fixed = {}
+        for channel, flag in zip(['coulomb', 'spinorbit'], [coulomb, spinorbit]):
+            if flag:
+                coupling = getattr(self.potential, channel)
+                if mix:
+                    self.fixed[channel] = self.propagator.fixed_factors(channel, coupling)
+                else:
+                    self.fixed[channel] = [self.propagator.fixed_operator(channel, coupling)]
+
+        # the entropy is fixed here so that seed=None still gives every worker the same streams
+        self.seed = seed
+        self.entropy = np.random.SeedSequence(seed).entropy
+        self.n_samples = n_samples
+        self.flip_aux = flip_aux
+        self.pruned = prune
+        self.is_ready = True
 
-        self.rng = np.random.default_rng(seed=seed)
+    def sample_rng(self, sample):
+        """the random stream of one sample, independent of every other sample"""
+        return np.random.default_rng(np.random.SeedSequence(self.entropy, spawn_key=(sample,)))
+
+    def sample_keys(self, samples):
+        """the 64-bit keys of the auxiliary fields of the given samples, counter_bits of one key drawn from the seed"""
+        base = np.random.SeedSequence(self.entropy).generate_state(1, np.uint64)
+        return counter_bits(base, np.asarray(samples, dtype=np.uint64)).ravel()
+
+    def draw(self, samples, full=False):
+        """auxiliary fields of the given samples, in the live layout (or the full layout if full)
+        the field in column c of sample s is a function of (key of s, c) alone (see counter_bits), so only the
+        requested columns are ever generated
+        RBM fields are returned as packed bits (see pack_aux), one row of ceil(n_aux / 8) bytes per sample"""
+        columns = np.arange(self.n_aux_full) if full else self.aux_index
+        keys = self.sample_keys(samples)
         if self.method=='HS':
-            self.aux_fields = self.rng.standard_normal(size=(n_samples,n_aux))
-            if flip_aux:
-                self.aux_fields = - self.aux_fields
+            u = counter_bits(keys, 2*columns) >> np.uint64(11)
+            v = counter_bits(keys, 2*columns + 1) >> np.uint64(11)
+            # Box-Muller, with u in (0, 1] and v in [0, 1)
+            out = np.sqrt(-2. * np.log((u + 1.) * 2.**-53)) * np.cos(2. * np.pi * v * 2.**-53)
         elif self.method=='RBM':
-            self.aux_fields = self.rng.integers(0,2,size=(n_samples,n_aux))
-            if flip_aux:
-                self.aux_fields = np.ones_like(self.aux_fields) - self.aux_fields
-        self.is_ready = True
+            out = pack_aux(counter_bits(keys, columns) >> np.uint64(63))
+        if self.flip_aux:
+            out = self.flip(out)
+        return out
+
+    def aux_fields_range(self, start, stop, full=False):
+        """auxiliary fields of the samples start:stop"""
+        return self.draw(range(start, stop), full)
+
+    @property
+    def aux_fields(self):
+        """all auxiliary fields, drawn on demand (runs never build this array)"""
+        return self.aux_fields_range(0, self.n_samples)
+
+    def full_aux_fields(self):
+        """the auxiliary fields in the full (unpruned) layout; the columns at self.aux_index are self.aux_fields
+        (after unpack_aux for RBM)"""
+        return self.aux_fields_range(0, self.n_samples, full=True)
+
+    def flip(self, aux_fields):
+        """the antithetic auxiliary fields, -x for HS and 1-h for RBM (a bitwise NOT of packed bits)"""
+        if self.method=='HS':
+            return - aux_fields
+        elif self.method=='RBM':
+            if aux_fields.dtype==np.uint8:
+                return np.invert(aux_fields)
+            return 1 - aux_fields
 
-    def bracket(self, bra, ket, aux_fields):
+    def bracket(self, bra, ket, aux_fields, rng=None):
+        """<bra|G|ket> for one sample; rng (a fresh generator if None) shuffles the factors if self.mix
+        nothing on the integrator is modified, so brackets can be evaluated from several threads"""
         ket_prop = ket.copy()
+        prop_list = self.factors(aux_fields)
+        if self.mix:
+            rng = np.random.default_rng() if rng is None else rng
+            rng.shuffle(prop_list)
+        for p in prop_list:
+            ket_prop = p.multiply_state(ket_prop)
+        return bra.inner(ket_prop)
+
+    def bracket_balanced(self, bra, ket, aux_fields, rng=None):
+        """<bra|G|ket> for aux_fields and for the flipped fields, with the same factor ordering
+        each sampled factor is built once from its even and odd parts in the field, which give both signs, and the fixed
+        factors are shared"""
+        pairs = self.factors(aux_fields, balance=True)
+        if self.mix:
+            rng = np.random.default_rng() if rng is None else rng
+            rng.shuffle(pairs)
+        ket_plus = ket.copy()
+        ket_minus = ket.copy()
+        for p, m in pairs:
+            ket_plus = p.multiply_state(ket_plus)
+            ket_minus = m.multiply_state(ket_minus)
+        return bra.inner(ket_plus), bra.inner(ket_minus)
+
+    def factors(self, aux_fields, balance=False):
+        """all factors for one sample, channel by channel; packed RBM fields are unpacked here
+        if balance, pairs of factors for aux_fields and for the flipped fields"""
+        if aux_fields.dtype==np.uint8:
+            aux_fields = unpack_aux(aux_fields, len(self.aux_index))
         idx = 0
-        self.prop_list = []
+        out = []
         if self.sigma:
-            self.prop_list.extend( self.propagator.factors_sigma(self.potential, aux_fields[idx : idx + self.propagator.n_aux_sigma] ) )
-            idx += self.propagator.n_aux_sigma
+            out.extend( self.propagator.factors_sigma(self.potential.sigma, aux_fields[idx : idx + self.n_aux['sigma']], balance ) )
+            idx += self.n_aux['sigma']
         if self.sigmatau:
-            self.prop_list.extend( self.propagator.factors_sigmatau(self.potential, aux_fields[idx : idx + self.propagator.n_aux_sigmatau] ) )
-            idx += self.propagator.n_aux_sigmatau
+            out.extend( self.propagator.factors_sigmatau(self.potential.sigmatau, aux_fields[idx : idx + self.n_aux['sigmatau']], balance ) )
+            idx += self.n_aux['sigmatau']
         if self.tau:
-            self.prop_list.extend( self.propagator.factors_tau(self.potential, aux_fields[idx : idx + self.propagator.n_aux_tau] ) )
-            idx += self.propagator.n_aux_tau
+            out.extend( self.propagator.factors_tau(self.potential.tau, aux_fields[idx : idx + self.n_aux['tau']], balance ) )
+            idx += self.n_aux['tau']
         if self.coulomb:
-            self.prop_list.extend( self.propagator.factors_coulomb(self.potential, aux_fields[idx : idx + self.propagator.n_aux_coulomb] ) )
-            idx += self.propagator.n_aux_coulomb
+            out.extend( (f, f) if balance else f for f in self.fixed['coulomb'] )
+            out.extend( self.propagator.factors_coulomb(self.potential.coulomb, aux_fields[idx : idx + self.n_aux['coulomb']], fixed=False, balance=balance ) )
+            idx += self.n_aux['coulomb']
         if self.spinorbit:
-            self.prop_list.extend( self.propagator.factors_spinorbit(self.potential, aux_fields[idx : idx + self.propagator.n_aux_spinorbit] ) )
-            idx += self.propagator.n_aux_spinorbit
+            out.extend( (f, f) if balance else f for f in self.fixed['spinorbit'] )
+            out.extend( self.propagator.factors_spinorbit(self.potential.spinorbit, aux_fields[idx : idx + self.n_aux['spinorbit']], fixed=False, balance=balance ) )
+            idx += self.n_aux['spinorbit']
+        return out
+
+    def bracket_batch(self, bra, ket, aux_fields, rngs=None, balance=False):
+        """<bra|G|ket> for every row of aux_fields, propagating all samples at once
+        if self.mix, the ordering of the factors of each sample is drawn from its stream in rngs (fresh streams if None)
+        if balance, returns an array of shape (2, n_samples) with the brackets for the flipped fields in the second row"""
+        n_samples = aux_fields.shape[0]
+        terms = self.terms
+        order = None
+        coefficients = ket.coefficients
         if self.mix:
-            self.rng.shuffle(self.prop_list)
-        for p in self.prop_list:
-            ket_prop = p.multiply_state(ket_prop)
-        return bra.inner(ket_prop)
-
-    def run(self, bra, ket):
+            if rngs is None:
+                rngs = [np.random.default_rng() for _ in range(n_samples)]
+            order = np.stack([rng.permutation(len(terms)) for rng in rngs]).reshape(n_samples, len(terms))
+        else:
+            # the terms before the first sampled one (e.g. the composed fixed terms) are the same for every sample,
+            # so they are applied once to the ket before it is copied into the batch
+            columns = self.propagator._aux_columns(terms)
+            n_shared = next((t for t, col in enumerate(columns) if col is not None), len(terms))
+            coefficients = self.propagator.propagate_batch(terms[:n_shared], coefficients[np.newaxis], aux_fields[:1])[0]
+            terms = terms[n_shared:]
+        coefficients = np.stack(n_samples*[coefficients])
+        coefficients = self.propagator.propagate_batch(terms, coefficients, aux_fields, order, balance)
+        out = np.prod(np.matmul(bra.coefficients, coefficients).reshape(-1, self.n_particles), axis=1)
+        if balance:
+            return out.reshape(2, n_samples)
+        return out
+
+    def evaluate(self, bra, ket, start, stop, balance=False):
+        """brackets for the samples start:stop, whose auxiliary fields and orderings are drawn here from their own streams
+        (the streams of sample_rng are only made if self.mix)
+        returns an array of shape (stop - start,), or (2, stop - start) if balance"""
+        aux_fields = self.draw(range(start, stop))
+        rngs = [self.sample_rng(t) for t in range(start, stop)] if self.mix else None
+        if self.batched:
+            return self.bracket_batch(bra, ket, aux_fields, rngs, balance)
+        rngs = rngs or [None] * (stop - start)
+        if balance:
+            b_list = [self.bracket_balanced(bra, ket, aux, rng) for aux, rng in zip(aux_fields, rngs)]
+            return np.array(b_list).reshape(-1, 2).T
+        return np.array([self.bracket(bra, ket, aux, rng) for aux, rng in zip(aux_fields, rngs)]).flatten()
+
+    def evaluate_statistics(self, bra, ket, start, stop, balance=False, keep_samples=False):
+        """the brackets of the samples start:stop reduced to a RunningStatistics; if balance, of the averages of each
+        sample and its flipped partner"""
+        b_array = self.evaluate(bra, ket, start, stop, balance)
+        if balance:
+            b_array = np.mean(b_array, axis=0)
+        return RunningStatistics(start, keep_samples).add(b_array)
+
+    def _imap(self, function, args):
+        """function over the argument tuples on self.backend, yielding the results in order as they arrive"""
+        n_threads = self.blas_threads
+        if n_threads is None and self.backend!='serial':
+            n_threads = 1
+        tasks = [(function, a) for a in args]
+        if self.backend=='serial':
+            with limit_blas_threads(n_threads):
+                yield from map(_star, tqdm(tasks))
+        elif self.backend=='thread':
+            with limit_blas_threads(n_threads), ThreadPool(processes=self.n_processes) as pool:
+                yield from tqdm(pool.imap(_star, tasks), total=len(tasks))
+        elif self.backend=='process':
+            with Pool(processes=self.n_processes, initializer=_init_blas, initargs=(n_threads,)) as pool:
+                yield from tqdm(pool.imap(_star, tasks), total=len(tasks))
+
+    def run_chunks(self, bra, ket, ranges, balance=False, statistics=False, keep_samples=False):
+        """evaluates the (start, stop) ranges of samples with evaluate (or evaluate_statistics) on self.backend, yielding
+        the results in order"""
+        if statistics:
+            args = [(bra, ket, start, stop, balance, keep_samples) for start, stop in ranges]
+            return self._imap(self.evaluate_statistics, args)
+        return self._imap(self.evaluate, [(bra, ket, start, stop, balance) for start, stop in ranges])
+
+    def _chunk_size(self, n_samples, n_processes, chunks_per_worker=4):
+        """a few chunks per worker for load balancing, and no more than batch_size samples per chunk, which bounds the
+        auxiliary fields held at once; the brackets do not depend on it"""
+        if self.chunk_size is not None:
+            return self.chunk_size
+        return min(max(1, -(-n_samples // (chunks_per_worker * n_processes))), self.batch_size)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['session'] = None
+        return state
+
+    def run_shared(self, bra, ket, ranges, balance=False, statistics=False, keep_samples=False):
+        """evaluates the (start, stop) ranges of samples on the pool of self.session, or of a temporary session, yielding
+        the results in order
+        the integrator, propagator, potential and states are published once, so a task is just a few handles and a range"""
+        if self.session is None:
+            blas = 1 if self.blas_threads is None else self.blas_threads
+            with IntegratorSession(self.n_processes, blas) as session:
+                yield from self._run_session(session, bra, ket, ranges, balance, statistics, keep_samples)
+        else:
+            yield from self._run_session(self.session.open(), bra, ket, ranges, balance, statistics, keep_samples)
+
+    def _run_session(self, session, bra, ket, ranges, balance, statistics=False, keep_samples=False):
+        worker_state = copy.copy(self)
+        worker_state.propagator = None
+        worker_state.potential = None
+        handles = (session.publish(worker_state), session.publish(self.propagator), session.publish(self.potential),
+                   session.publish(bra), session.publish(ket))
+        tasks = [(_evaluate_range, (handles, start, stop, balance, statistics, keep_samples)) for start, stop in ranges]
+        try:
+            yield from tqdm(session.pool.imap(_star, tasks), total=len(tasks))
+        finally:
+            for handle in handles:
+                session.release(handle)
+
+    def _uses_session(self):
+        return self.session is not None or (self.backend=='process' and self.shared)
+
+    def fingerprint(self, bra, ket):
+        """hash of everything that determines the brackets of a run, used to check that a checkpoint belongs to it"""
+        propagator = (type(self.propagator).__name__, self.propagator.dt, self.propagator.isospin,
+                      self.propagator.include_prefactors)
+        settings = (self.method, self.entropy, self.n_samples, self.sigma, self.sigmatau, self.tau, self.coulomb,
+                    self.spinorbit, self.mix, self.flip_aux, self.batched, self.aux_index.tobytes())
+        states = (bra.coefficients.tobytes(), ket.coefficients.tobytes())
+        return hashlib.sha1(pickle.dumps((propagator, settings, self.potential, states))).hexdigest()
+
+    def run(self, bra, ket, balance=False, statistics=False, keep_samples=False, checkpoint=None, checkpoint_interval=60.):
+        """the brackets for all samples
+        if balance, also evaluates every sample with the flipped auxiliary fields (antithetic sampling) in the same pass,
+        and returns the pair of arrays (b_plus, b_minus)
+        if statistics, every chunk is reduced where it is evaluated and a RunningStatistics of the brackets (of the pair
+        averages if balance) is returned instead; the raw values are kept in it only if keep_samples
+        if checkpoint is a filename, the progress is saved there at most every checkpoint_interval seconds and at the end,
+        and an interrupted run can be finished with resume()"""
         if not self.is_ready:
             raise ValueError("Integrator is not ready. Did you run .setup() ?")
         assert (ket.ketwise) and (not bra.ketwise)
-        if self.parallel:
-            with Pool(processes=self.n_processes) as pool:
-                b_array = pool.starmap_async(self.bracket, tqdm([(bra, ket, aux) for aux in self.aux_fields], leave=True)).get()
-        else:
-            b_array = list(itertools.starmap(self.bracket, tqdm([(bra, ket, aux) for aux in self.aux_fields])))
-        b_array = np.array(b_array).flatten()
-        return b_array
+        n_processes = self.session.n_processes if self.session is not None else (self.n_processes or os.cpu_count())
+        state = {'fingerprint': self.fingerprint(bra, ket) if checkpoint is not None else None,
+                 'balance': balance,
+                 'statistics': statistics,
+                 'keep_samples': keep_samples,
+                 'chunk_size': self._chunk_size(self.n_samples, n_processes),
+                 'checkpoint_interval': checkpoint_interval,
+                 'ranges': [],
+                 'result': None if statistics else []}
+        return self._run(bra, ket, state, checkpoint)
+
+    def resume(self, bra, ket, checkpoint):
+        """finishes the run saved in checkpoint and returns what run() would have returned, bit for bit
+        the integrator must be set up as it was for the run; the completed ranges are not evaluated again, and since the
+        random stream of every sample is fixed by its index, the remaining samples continue exactly where the run stopped"""
+        if not self.is_ready:
+            raise ValueError("Integrator is not ready. Did you run .setup() ?")
+        with open(checkpoint, 'rb') as f:
+            state = pickle.load(f)
+        if state['fingerprint']!=self.fingerprint(bra, ket):
+            raise ValueError("The checkpoint does not belong to this setup, potential and states.")
+        return self._run(bra, ket, state, checkpoint)
+
+    def _run(self, bra, ket, state, checkpoint):
+        """evaluates the chunks after state['ranges'], merging the results in sample order and checkpointing on the way"""
+        chunk_size = state['chunk_size']
+        first = state['ranges'][-1][1] if state['ranges'] else 0
+        ranges = [(start, min(start + chunk_size, self.n_samples)) for start in range(first, self.n_samples, chunk_size)]
+        args = (bra, ket, ranges, state['balance'], state['statistics'], state['keep_samples'])
+        results = self.run_shared(*args) if self._uses_session() else self.run_chunks(*args)
+        saved = time.time()
+        for sample_range, result in zip(ranges, results):
+            if state['statistics']:
+                state['result'] = result if state['result'] is None else state['result'].merge(result)
+            else:
+                state['result'].append(result)
+            state['ranges'].append(sample_range)
+            if checkpoint is not None and time.time() - saved >= state['checkpoint_interval']:
+                _write_checkpoint(checkpoint, state)
+                saved = time.time()
+        if checkpoint is not None:
+            _write_checkpoint(checkpoint, state)
+        if state['statistics']:
+            return state['result']
+        b_array = np.concatenate(state['result'], axis=-1)
+        return (b_array[0], b_array[1]) if state['balance'] else b_array
+
+    def run_adaptive(self, bra, ket, target, reference=None, max_time=None, min_samples=1000, balance=False, keep_samples=False):
+        """samples until the standard error of <bra|G|ket> relative to its running mean (or to |reference|, e.g. the
+        value of self.exact(bra, ket), to target the ratio) is at most target, with the n_samples of setup as the budget
+        and max_time seconds (None for no limit) as the time budget
+        the samples are evaluated in waves of one chunk per worker and the error is checked after each wave, after at least
+        min_samples samples; unless the time budget is hit, the result does not depend on timing
+        returns the RunningStatistics of the samples used (of the pair averages if balance)"""
+        if not self.is_ready:
+            raise ValueError("Integrator is not ready. Did you run .setup() ?")
+        assert (ket.ketwise) and (not bra.ketwise)
+        n_processes = self.session.n_processes if self.session is not None else (self.n_processes or os.cpu_count())
+        # smaller chunks than run() uses, so that the error is checked often enough to stop close to the target
+        chunk_size = self._chunk_size(self.n_samples, n_processes, chunks_per_worker=16)
+        ranges = [(start, min(start + chunk_size, self.n_samples)) for start in range(0, self.n_samples, chunk_size)]
+        wave = 1 if self.backend=='serial' and self.session is None else n_processes
+        start_time = time.time()
+        stats = None
+        # the process backend keeps one pool for all waves
+        session = self.session.open() if self.session is not None else None
+        temporary = session is None and self.backend=='process'
+        if temporary:
+            session = IntegratorSession(self.n_processes, 1 if self.blas_threads is None else self.blas_threads).open()
+        try:
+            for first in range(0, len(ranges), wave):
+                args = (bra, ket, ranges[first : first + wave], balance, True, keep_samples)
+                results = self.run_chunks(*args) if session is None else self._run_session(session, *args)
+                for result in results:
+                    stats = result if stats is None else stats.merge(result)
+                scale = np.abs(stats.mean if reference is None else np.squeeze(reference))
+                if stats.n >= min_samples and stats.error <= target * scale:
+                    break
+                if max_time is not None and time.time() - start_time >= max_time:
+                    break
+        finally:
+            if temporary:
+                session.close()
+        return stats
             
-    def exact(self, bra, ket):
-        ex = ExactGFMC(self.n_particles, isospin=self.isospin)
-        g_exact = ex.make_g_exact(self.propagator.dt, 
-                                  self.potential,
-                                  self.sigma,
-                                  self.sigmatau,
-                                  self.tau,
-                                  self.coulomb,
-                                  self.spinorbit)
-        b_exact = bra.inner(g_exact.multiply_state(ket))
-        return b_exact
\ No newline at end of file
+    def exact_propagator(self, cache=True, max_bytes=None):
+        """the exact G for the potential, dt and channels of this setup, through exact_cache unless cache is False
+        G is a dense 4^A x 4^A matrix (2^A x 2^A without isospin), so this raises if it would take more than max_bytes
+        (None for exact_cache.memory_bytes); exact() never forms it"""
+        n_basis = (4 if self.isospin else 2) ** self.n_particles
+        if max_bytes is None:
+            max_bytes = exact_cache.memory_bytes
+        if 16 * n_basis**2 > max_bytes:
+            raise ValueError(f"The exact propagator would take {16 * n_basis**2} bytes, more than max_bytes={max_bytes}; use exact() for brackets.")
+        def build():
+            ex = ExactGFMC(self.n_particles, isospin=self.isospin)
+            return ex.make_g_exact(self.propagator.dt,
+                                   self.potential,
+                                   self.sigma,
+                                   self.sigmatau,
+                                   self.tau,
+                                   self.coulomb,
+                                   self.spinorbit)
+        if not cache:
+            return build()
+        key = exact_cache.propagator_key(self.n_particles, self.isospin, self.propagator.dt, self.potential,
+                                         self.sigma, self.sigmatau, self.tau, self.coulomb, self.spinorbit)
+        return exact_cache.propagator(key, self.n_particles, self.isospin, build)
+
+    def exact(self, bra, ket, cache=True):
+        """<bra|G|ket> with the exact G, applied to ket as local gates (see ExactGFMC.apply_g_exact) so that G is never formed
+        with cache, the brackets are memoized in exact_cache, so repeated setups of the same configuration (balanced,
+        mixed or not) reuse them"""
+        def compute():
+            ex = ExactGFMC(self.n_particles, isospin=self.isospin)
+            return bra.inner(ex.apply_g_exact(ket,
+                                              self.propagator.dt,
+                                              self.potential,
+                                              self.sigma,
+                                              self.sigmatau,
+                                              self.tau,
+                                              self.coulomb,
+                                              self.spinorbit))
+        if not cache:
+            return compute()
+        key = exact_cache.propagator_key(self.n_particles, self.isospin, self.propagator.dt, self.potential,
+                                         self.sigma, self.sigmatau, self.tau, self.coulomb, self.spinorbit)
+        return exact_cache.bracket(exact_cache.bracket_key(key, bra, ket), compute)
\ No newline at end of file